@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Approximate nearest-neighbour search for large galleries
+
+IVF index: gallery histograms are projected to a small dense space and
+clustered with k-means; a query only re-ranks (with the exact chi-square
+distance) the gallery columns of its ``n_probe`` closest clusters.
+
+Run directly to report recall against exact search on the cached gallery:
+
+    python ann_index.py --probes 1 2 4 8 16
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Dimension of the random projection used for clustering
+PROJECTION_DIM = 64
+KMEANS_ITERATIONS = 10
+
+# Columns projected at once while (re)building the index
+CHUNK_COLUMNS = 2048
+
+
+class IVFIndex:
+    """Inverted-file index over the columns of a GalleryMatcher
+
+    ``assignments`` stays aligned with the matcher columns: the matcher
+    calls ``add`` / ``move`` whenever it appends or compacts columns.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+
+        self.projection = None
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.built_size = 0
+
+    @property
+    def is_built(self):
+        return self.centroids is not None
+
+    def project(self, matrix):
+        """Project histogram columns (features x N) to (N x PROJECTION_DIM)
+
+        The square root turns the chi-square geometry into an (approximately)
+        Euclidean one, which is what k-means and the projection preserve.
+        """
+        result = np.empty((matrix.shape[1], PROJECTION_DIM), dtype=np.float32)
+        for start in range(0, matrix.shape[1], CHUNK_COLUMNS):
+            block = np.sqrt(matrix[:, start:start + CHUNK_COLUMNS])
+            result[start:start + block.shape[1]] = block.T @ self.projection
+        return result
+
+    @staticmethod
+    def _nearest(points, centroids, count=1):
+        distances = (
+            (centroids ** 2).sum(axis=1)[np.newaxis, :]
+            - 2.0 * points @ centroids.T
+        )
+        if count >= len(centroids):
+            return np.argsort(distances, axis=1)
+        nearest = np.argpartition(distances, count - 1, axis=1)[:, :count]
+        order = np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1)
+        return np.take_along_axis(nearest, order, axis=1)
+
+    def build(self, matrix):
+        """Cluster the gallery columns (features x N) from scratch"""
+        rng = np.random.default_rng(self.seed)
+        self.projection = (
+            rng.standard_normal((matrix.shape[0], PROJECTION_DIM)).astype(np.float32)
+            / np.float32(np.sqrt(PROJECTION_DIM))
+        )
+
+        size = matrix.shape[1]
+        if size == 0:
+            self.centroids = None
+            self.assignments = np.empty(0, dtype=np.int32)
+            self.built_size = 0
+            return
+
+        points = self.project(matrix)
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(size))), size)
+        centroids = points[rng.choice(size, n_lists, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            assignments = self._nearest(points, centroids)[:, 0]
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, points)
+            counts = np.bincount(assignments, minlength=n_lists)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+
+        self.centroids = centroids
+        self.assignments = self._nearest(points, centroids)[:, 0].astype(np.int32)
+        self.built_size = size
+
+    def add(self, histograms):
+        """Assign new gallery rows (N x features) to their closest list"""
+        points = self.project(np.asarray(histograms, dtype=np.float32).T)
+        lists = self._nearest(points, self.centroids)[:, 0].astype(np.int32)
+        self.assignments = np.concatenate([self.assignments, lists])
+
+    def move(self, sources, targets, size):
+        """Mirror a compaction of the matcher: columns ``sources`` moved to
+        ``targets``, then the gallery truncated to ``size`` columns"""
+        self.assignments[targets] = self.assignments[sources]
+        self.assignments = self.assignments[:size].copy()
+
+    def candidates(self, histograms):
+        """Gallery columns to re-rank for each query row (N x features)"""
+        points = self.project(np.asarray(histograms, dtype=np.float32).T)
+        probes = self._nearest(points, self.centroids, min(self.n_probe, len(self.centroids)))
+        return [np.flatnonzero(np.isin(self.assignments, lists)) for lists in probes]
+
+
+# -----------------------------------------------------
+# قياس دقة البحث التقريبي
+# -----------------------------------------------------
+def measure_recall(matcher, histograms, labels, k=10):
+    """Recall@k of the matcher's index against exact search
+
+    Each query is a gallery row; its own label is excluded from both result
+    lists so the trivial self-match does not inflate the score. A result
+    counts as a hit when it is as close as the exact k-th neighbour, so
+    ties between duplicate photos are not counted as misses.
+    """
+    index = matcher.index
+    matcher.index = None
+    try:
+        start = time.perf_counter()
+        exact_labels, exact_distances = matcher.search(histograms, k + 1)
+        exact_time = time.perf_counter() - start
+    finally:
+        matcher.index = index
+
+    start = time.perf_counter()
+    approx_labels, approx_distances = matcher.search(histograms, k + 1)
+    approx_time = time.perf_counter() - start
+
+    hits = 0
+    total = 0
+    for i, own in enumerate(labels):
+        exact = [d for l, d in zip(exact_labels[i], exact_distances[i]) if l != own and l >= 0][:k]
+        found = [d for l, d in zip(approx_labels[i], approx_distances[i]) if l != own and l >= 0][:k]
+        if not exact:
+            continue
+        limit = exact[-1] + 1e-3
+        hits += sum(1 for d in found if d <= limit)
+        total += len(exact)
+
+    return {
+        "recall": hits / total if total else 1.0,
+        "exact_ms_per_query": 1000 * exact_time / max(1, len(histograms)),
+        "approx_ms_per_query": 1000 * approx_time / max(1, len(histograms)),
+    }
+
+
+def main():
+    from face_recognizer import CACHE_DIR, CACHE_VERSION
+    from gallery_matcher import GalleryMatcher
+
+    parser = argparse.ArgumentParser(description="Recall of the IVF index against exact search")
+    parser.add_argument("--gallery", default=os.path.join(CACHE_DIR, f"gallery_v{CACHE_VERSION}.npz"),
+                        help="gallery .npz written by FaceRecognizer")
+    parser.add_argument("--lists", type=int, default=None, help="number of IVF lists")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--queries", type=int, default=200, help="gallery rows used as queries")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.gallery):
+        print(f"✗ الملف غير موجود: {args.gallery}")
+        return 1
+
+    matcher = GalleryMatcher()
+    matcher.load(args.gallery)
+    matcher.set_index(IVFIndex(n_lists=args.lists))
+    print(f"المعرض: {len(matcher)} وجه، {len(matcher.index.centroids)} قائمة")
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(matcher), min(args.queries, len(matcher)), replace=False)
+    histograms = matcher.histograms[rows]
+    labels = matcher.labels[rows]
+
+    for n_probe in args.probes:
+        matcher.index.n_probe = n_probe
+        stats = measure_recall(matcher, histograms, labels, args.k)
+        print(f"probes={n_probe:3d}  recall@{args.k}={stats['recall']:.3f}  "
+              f"exact={stats['exact_ms_per_query']:.2f}ms  "
+              f"ivf={stats['approx_ms_per_query']:.2f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ترحيل قوالب الوجوه
+One-shot backfill of the stored face crops (templates) of every person
+
+    python backfill_templates.py --dry-run
+    python backfill_templates.py --workers 8
+
+Brings every person's template to the current format (CACHE_VERSION,
+normalized 200x200 crops). Templates of older versions are converted from
+the stored crop itself; only people without a usable template have their
+photo decoded and run through the detector, once. The gallery histogram
+cache is rebuilt on the way and caches of older versions are deleted, so
+later starts read nothing but the templates.
+
+Loading the gallery does the same lazily; running this ahead of an
+upgrade keeps that work off the first start of the bridge and camera.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+
+def describe(counts, current):
+    up_to_date = counts.get(current, 0)
+    missing = counts.get(None, 0)
+    older = sum(n for version, n in counts.items() if version not in (current, None))
+    return (f"{sum(counts.values())} شخص: {up_to_date} قالب محدث، "
+            f"{older} قالب قديم، {missing} بدون قالب")
+
+
+def remove_stale_caches(cache_dir, current_path):
+    """Delete gallery caches written for other template versions"""
+    removed = 0
+    for path in glob.glob(os.path.join(cache_dir, "gallery_v*.npz")):
+        if os.path.abspath(path) != os.path.abspath(current_path):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def main():
+    from database import Database
+    from face_recognizer import CACHE_VERSION, FaceRecognizer
+
+    parser = argparse.ArgumentParser(description="Backfill normalized face templates for every person")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="threads decoding photos that need extraction (default: CPU count)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report how many templates need work")
+    args = parser.parse_args()
+
+    db = Database()
+    before = db.count_face_templates()
+    print(f"قبل: {describe(before, CACHE_VERSION)}")
+
+    if args.dry_run:
+        return 0
+
+    # Loading the gallery upgrades old templates, extracts the missing
+    # ones and saves them in bulk, then rebuilds the histogram cache
+    started = time.perf_counter()
+    recognizer = FaceRecognizer(workers=args.workers)
+    elapsed = time.perf_counter() - started
+
+    after = db.count_face_templates()
+    print(f"بعد:  {describe(after, CACHE_VERSION)} ({elapsed:.1f}s)")
+
+    removed = remove_stale_caches(recognizer.cache_dir, recognizer.model_path)
+    if removed:
+        print(f"✓ تم حذف {removed} ملف ذاكرة مؤقتة قديم")
+
+    # People left without a template have no readable face in their photo
+    # (or no photo); they are not part of the gallery either way
+    left = sum(n for version, n in after.items() if version != CACHE_VERSION)
+    if left:
+        print(f"⚠ {left} شخص بدون قالب صالح (لا يوجد وجه أو الصورة مفقودة)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
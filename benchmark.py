@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+قياس أداء نظام التعرف على الوجوه
+Reproducible performance benchmark of FaceRecognizer (headless)
+
+    python benchmark.py --sizes 10,1000,10000,50000 --output results.json
+    python benchmark.py --sizes 1000 --video entrance.mp4 --baseline data/benchmark_baseline.json
+    python benchmark.py --sizes 10,1000 --save-baseline
+
+For every gallery size a synthetic gallery is built in a scratch
+directory from augmented copies (flip, crop, brightness) of the faces in
+data/photos, stored as face templates the way enrollment stores them.
+It then measures:
+
+- ``load_known_faces`` without the histogram cache (first start) and
+  with it (normal start)
+- ``add_person_from_image`` latency for new augmented photos
+- ``recognize_faces_in_frame`` latency for frames holding 0..8 faces
+- end-to-end FaceTracker frames per second on a recorded video, or on a
+  synthetic clip of the sample photos when no video is given
+
+Results are written as JSON. With ``--baseline`` every timing is compared
+with a stored run and the exit status is 1 when one got slower than
+``--tolerance`` allows. Memory use grows with the gallery: about 100 KB
+per person (histogram and face crop), so 50k people need ~5 GB of RAM.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DIR = os.path.join(REPO_DIR, "data", "photos")
+BASELINE_PATH = os.path.join(REPO_DIR, "data", "benchmark_baseline.json")
+
+DEFAULT_SIZES = (10, 1000, 10000, 50000)
+
+# Faces per synthetic frame for the recognize_faces_in_frame latency
+FACE_COUNTS = (0, 1, 2, 4, 8)
+FRAME_SIZE = (1280, 720)
+
+# People generated and written to the database per batch
+BUILD_BATCH = 1000
+
+# Timed metrics compared against the baseline: whether lower is better
+# and the smallest absolute change counted as a regression (timer noise
+# would otherwise flag millisecond-sized loads of tiny galleries)
+METRICS = {
+    "load_cold_s": (True, 0.05),
+    "load_warm_s": (True, 0.05),
+    "enroll_ms_median": (True, 5.0),
+    "recognize_ms": (True, 2.0),
+    "fps": (False, 0.5),
+}
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the recognizer's progress output inside timed sections"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    # FaceRecognizer and Database keep their files under ./data
+    previous = os.getcwd()
+    os.makedirs(os.path.join(path, "data", "photos"), exist_ok=True)
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def log(text):
+    # Progress goes to stderr so the JSON on stdout stays parseable
+    print(text, file=sys.stderr, flush=True)
+
+
+def median_ms(timings):
+    return 1000 * statistics.median(timings)
+
+
+# -----------------------------------------------------
+# العينات والتعديلات
+# -----------------------------------------------------
+def load_samples(recognizer, sample_dir):
+    """(photo, face crop) pairs for every sample photo with a face"""
+    samples = []
+    for filename in sorted(os.listdir(sample_dir)):
+        path = os.path.join(sample_dir, filename)
+        with quiet():
+            image = recognizer.read_image(path)
+            face = recognizer.extract_face_from_path(filename, path) if image is not None else None
+        if face is not None:
+            samples.append((image, face))
+    return samples
+
+
+def augment(image, rng, size=None):
+    """Random flip, crop (80-100%) and brightness/contrast change"""
+    if rng.random() < 0.5:
+        image = cv2.flip(image, 1)
+
+    height, width = image.shape[:2]
+    scale = rng.uniform(0.8, 1.0)
+    crop_h, crop_w = int(height * scale), int(width * scale)
+    y = int(rng.integers(0, height - crop_h + 1))
+    x = int(rng.integers(0, width - crop_w + 1))
+    image = image[y:y + crop_h, x:x + crop_w]
+    image = cv2.resize(image, size or (width, height))
+
+    return cv2.convertScaleAbs(image, alpha=rng.uniform(0.7, 1.3), beta=rng.uniform(-30, 30))
+
+
+def build_gallery(recognizer, samples, size, rng):
+    """Insert ``size`` synthetic people with stored face templates
+
+    Their photo paths do not exist, so loading uses the templates only,
+    as it does for people whose photos were archived.
+    """
+    from face_recognizer import FACE_SIZE, normalize_face
+
+    for start in range(0, size, BUILD_BATCH):
+        count = min(BUILD_BATCH, size - start)
+        people = [(f"synthetic_{start + i:06d}", f"data/photos/synthetic_{start + i:06d}.jpg")
+                  for i in range(count)]
+        person_ids = recognizer.db.add_people(people)
+
+        rows = []
+        for person_id, (_, photo_path) in zip(person_ids, people):
+            face = samples[int(rng.integers(len(samples)))][1]
+            rows.append(recognizer.face_template_row(
+                person_id, photo_path, normalize_face(augment(face, rng, FACE_SIZE))))
+        recognizer.db.save_face_templates(rows)
+
+
+def synthetic_frame(samples, faces, offset=0):
+    """BGR frame with ``faces`` sample photos laid out on a grid"""
+    width, height = FRAME_SIZE
+    frame = np.full((height, width, 3), 90, dtype=np.uint8)
+    if faces == 0:
+        return frame
+
+    columns = int(np.ceil(np.sqrt(faces * width / height)))
+    rows = int(np.ceil(faces / columns))
+    cell_w, cell_h = width // columns, height // rows
+
+    for i in range(faces):
+        image = samples[(i + offset) % len(samples)][0]
+        scale = 0.9 * min(cell_w / image.shape[1], cell_h / image.shape[0])
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        x = (i % columns) * cell_w + (cell_w - image.shape[1]) // 2
+        y = (i // columns) * cell_h + (cell_h - image.shape[0]) // 2
+        frame[y:y + image.shape[0], x:x + image.shape[1]] = image
+    return frame
+
+
+def synthetic_clip(samples, frames):
+    """Frames of two faces drifting across the picture"""
+    base = synthetic_frame(samples, 2)
+    for index in range(frames):
+        shift = int(40 * np.sin(index / 15))
+        yield np.roll(base, shift, axis=1)
+
+
+def video_clip(path, frames):
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise SystemExit(f"تعذر فتح الفيديو: {path}")
+    try:
+        for _ in range(frames):
+            ret, frame = capture.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+# -----------------------------------------------------
+# القياسات
+# -----------------------------------------------------
+def measure_load(recognizer):
+    # Without the histogram cache every template is turned into an LBPH
+    # histogram, as on the first start after an upgrade
+    if os.path.exists(recognizer.model_path):
+        os.remove(recognizer.model_path)
+
+    with quiet():
+        started = time.perf_counter()
+        recognizer.load_known_faces()
+        cold = time.perf_counter() - started
+
+        started = time.perf_counter()
+        recognizer.load_known_faces()
+        warm = time.perf_counter() - started
+
+    return {"load_cold_s": cold, "load_warm_s": warm}
+
+
+def measure_enroll(recognizer, samples, count, rng, upload_dir):
+    """Enroll ``count`` new augmented photos, then remove them again"""
+    os.makedirs(upload_dir, exist_ok=True)
+    timings = []
+    enrolled = []
+
+    for i in range(count):
+        image = augment(samples[i % len(samples)][0], rng)
+        path = os.path.join(upload_dir, f"upload_{i}.jpg")
+        cv2.imwrite(path, image)
+
+        name = f"benchmark_upload_{i}"
+        with quiet():
+            started = time.perf_counter()
+            success, _, _ = recognizer.add_person_from_image(name, path)
+            timings.append(time.perf_counter() - started)
+        if success:
+            enrolled.append(name)
+
+    # Keep the gallery at its nominal size for the following measurements
+    added = [person_id for person_id, name in recognizer.known_face_names.items()
+             if name in enrolled]
+    recognizer.delete_people(added)
+
+    return {
+        "enroll_ms_median": median_ms(timings),
+        "enroll_ms_max": 1000 * max(timings),
+        "enrolled": len(enrolled),
+        "enroll_attempts": count,
+    }
+
+
+def measure_recognize(recognizer, samples, repeat):
+    latencies = {}
+    detected = {}
+
+    for faces in FACE_COUNTS:
+        frame = synthetic_frame(samples, faces)
+        detected[str(faces)] = len(recognizer.detect_faces_in_frame(
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)))
+
+        timings = []
+        with quiet():
+            for _ in range(repeat):
+                # annotate_frame draws into the frame it is given
+                work = frame.copy()
+                started = time.perf_counter()
+                recognizer.recognize_faces_in_frame(work)
+                timings.append(time.perf_counter() - started)
+        latencies[str(faces)] = median_ms(timings)
+
+    return {"recognize_ms": latencies, "faces_detected": detected}
+
+
+def measure_fps(recognizer, clip):
+    from face_recognizer import FaceTracker
+
+    tracker = FaceTracker(recognizer)
+    frames = 0
+    with quiet():
+        started = time.perf_counter()
+        for frame in clip:
+            tracker.process(frame)
+            frames += 1
+        elapsed = time.perf_counter() - started
+
+    return {"fps": frames / elapsed if elapsed else None, "fps_frames": frames}
+
+
+def run_size(size, args, samples_dir, workdir):
+    from face_recognizer import FaceRecognizer
+
+    rng = np.random.default_rng(args.seed)
+    log(f"▶ معرض بحجم {size}")
+
+    with working_directory(os.path.join(workdir, f"gallery_{size}")):
+        with quiet():
+            recognizer = FaceRecognizer(ann_probes=args.ann_probes)
+        samples = load_samples(recognizer, samples_dir)
+        if not samples:
+            raise SystemExit(f"لا توجد وجوه في {samples_dir}")
+
+        started = time.perf_counter()
+        build_gallery(recognizer, samples, size, rng)
+        result = {"gallery_size": size, "build_s": time.perf_counter() - started}
+
+        result.update(measure_load(recognizer))
+        log(f"  تحميل: {result['load_cold_s']:.2f}s بدون ذاكرة مؤقتة، "
+              f"{result['load_warm_s']:.2f}s معها")
+
+        result.update(measure_enroll(recognizer, samples, args.enroll, rng, "uploads"))
+        log(f"  إضافة شخص: {result['enroll_ms_median']:.1f}ms "
+              f"({result['enrolled']}/{result['enroll_attempts']} مقبولة)")
+
+        result.update(measure_recognize(recognizer, samples, args.repeat))
+        log("  التعرف على إطار: " + "، ".join(
+            f"{faces} وجه {ms:.1f}ms" for faces, ms in result["recognize_ms"].items()))
+
+        if args.video:
+            clip = video_clip(args.video, args.video_frames)
+        else:
+            clip = synthetic_clip(samples, args.video_frames)
+        result.update(measure_fps(recognizer, clip))
+        log(f"  الإطارات في الثانية: {result['fps']:.1f}")
+
+        if resource is not None:
+            result["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        recognizer.db.close()
+
+    return result
+
+
+# -----------------------------------------------------
+# المقارنة مع خط الأساس
+# -----------------------------------------------------
+def flatten(results):
+    """{"<size>.<metric>[.<faces>]": (value, metric name)}"""
+    flat = {}
+    for size, metrics in results.items():
+        for name in METRICS:
+            value = metrics.get(name)
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    flat[f"{size}.{name}.{key}"] = (item, name)
+            elif value is not None:
+                flat[f"{size}.{name}"] = (value, name)
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """Print the change of every metric; returns the regressed ones"""
+    current = flatten(results)
+    previous = flatten(baseline.get("results", {}))
+    regressions = []
+
+    for key, (value, name) in current.items():
+        if key not in previous:
+            continue
+        old = previous[key][0]
+        if not old:
+            continue
+
+        lower_is_better, noise = METRICS[name]
+        change = (value - old) / old
+        worse = change > tolerance if lower_is_better else change < -tolerance
+        worse = worse and abs(value - old) > noise
+        if worse:
+            regressions.append(key)
+        log(f"  {'✗' if worse else '✓'} {key:32s} {old:10.3f} -> {value:10.3f} ({change:+.1%})")
+
+    return regressions
+
+
+def environment(args):
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "ann_probes": args.ann_probes,
+        "video": os.path.basename(args.video) if args.video else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmark of FaceRecognizer")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated gallery sizes")
+    parser.add_argument("--samples", default=SAMPLE_DIR,
+                        help="directory of sample photos to augment")
+    parser.add_argument("--video", default=None,
+                        help="recorded video for the FPS measurement (default: synthetic clip)")
+    parser.add_argument("--video-frames", type=int, default=300)
+    parser.add_argument("--enroll", type=int, default=5, help="photos enrolled per gallery")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per frame latency")
+    parser.add_argument("--ann-probes", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None,
+                        help="scratch directory (default: a temporary one, removed afterwards)")
+    parser.add_argument("--output", default=None, help="JSON results file (default: stdout)")
+    parser.add_argument("--baseline", default=None,
+                        help="compare with this results file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help=f"also store the results as {os.path.relpath(BASELINE_PATH, REPO_DIR)}")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    samples_dir = os.path.abspath(args.samples)
+    video = os.path.abspath(args.video) if args.video else None
+    args.video = video
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="face-benchmark-")
+    try:
+        results = {str(size): run_size(size, args, samples_dir, os.path.abspath(workdir))
+                   for size in sizes}
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"environment": environment(args), "results": results}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        log(f"✓ تم حفظ النتائج في {args.output}")
+    else:
+        print(text)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        log(f"✓ تم حفظ خط الأساس في {BASELINE_PATH}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        log(f"المقارنة مع {args.baseline} (السماحية {args.tolerance:.0%}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            log(f"✗ تراجع الأداء في {len(regressions)} قياس")
+            return 1
+        log("✓ لا يوجد تراجع في الأداء")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
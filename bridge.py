@@ -2,23 +2,185 @@
 # -*- coding: utf-8 -*-
 """
 Bridge between HTML form and Python camera app
-Saves uploaded image and launches camera recognition
+Saves uploaded image, queues it for enrollment and notifies the resident
+camera recognition process (starting it once if needed)
+
+Photos can be sent as the raw request body (``Content-Type: image/...``,
+name in the ``name`` query parameter), as a multipart form with ``name``
+and ``photo`` fields, or base64-encoded in JSON (legacy).
+
+/api/recognize and /api/recognize-batch identify the faces of uploaded
+photos against the gallery and answer with JSON, without the camera app.
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import base64
-from datetime import datetime
 import subprocess
 import sys
+import threading
+import metrics
 
 app = Flask(__name__)
 CORS(app)
 
+# Uploads larger than this are rejected with 413 before being stored
+app.config['MAX_CONTENT_LENGTH'] = 20 * 1024 * 1024
+
+# Raw uploads are copied to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Photos accepted by one /api/recognize-batch request
+RECOGNIZE_BATCH_LIMIT = 64
+
+PHOTO_EXTENSIONS = {
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/bmp': '.bmp',
+}
+
 # Ensure data directory exists
 os.makedirs("data/photos", exist_ok=True)
 
+# One recognizer shared by every request; built lazily on first use
+_recognizer = None
+_recognizer_lock = threading.Lock()
+
+
+def get_recognizer():
+    """Return the process-wide FaceRecognizer, creating it on first call"""
+    global _recognizer
+    with _recognizer_lock:
+        if _recognizer is None:
+            from face_recognizer import FaceRecognizer
+            _recognizer = FaceRecognizer()
+        return _recognizer
+
+
+# Durable queue of submitted reports, enrolled by background threads
+_report_queue = None
+_report_queue_lock = threading.Lock()
+
+
+def get_report_queue():
+    """Return the process-wide ReportQueue, starting its workers on first call"""
+    global _report_queue
+    with _report_queue_lock:
+        if _report_queue is None:
+            from database import Database
+            from report_queue import ReportQueue
+            _report_queue = ReportQueue(Database(), enroll_report)
+            _report_queue.start()
+        return _report_queue
+
+
+# camera_recognition.py started by this process, while it is starting up
+_camera_process = None
+_camera_lock = threading.Lock()
+
+
+def launch_camera(person_id=None):
+    """Tell the resident camera recognition process about a new person
+
+    It updates its gallery in place and comes to the front; it is only
+    started when it is not running yet.
+    """
+    global _camera_process
+    from recognition_service import send_command
+    
+    with _camera_lock:
+        # Without an id the camera compares its whole gallery with the database
+        reply = send_command('person_added', person_ids=[person_id] if person_id else None)
+        if reply is not None:
+            send_command('show')
+            print(f"✓ تم تحديث نظام التعرف على الوجوه ({reply.get('count')} شخص)")
+            return
+        
+        # Still loading the gallery; it reads the new person from the database
+        if _camera_process is not None and _camera_process.poll() is None:
+            return
+        
+        try:
+            if sys.platform == 'win32':
+                _camera_process = subprocess.Popen(['python', 'camera_recognition.py'], 
+                                                   creationflags=subprocess.CREATE_NEW_CONSOLE)
+            else:
+                _camera_process = subprocess.Popen(['python3', 'camera_recognition.py'])
+            
+            print("✓ تم تشغيل نظام التعرف على الوجوه")
+        except Exception as e:
+            print(f"تحذير: فشل في تشغيل الكاميرا تلقائياً: {str(e)}")
+
+
+def enroll_report(name, photo_path):
+    """Report queue handler: add the person using the shared face_recognizer
+
+    The upload already sits at its final place in data/photos, so it is
+    read once and enrolled from memory without another copy.
+    """
+    with open(photo_path, 'rb') as f:
+        image_bytes = f.read()
+    
+    with metrics.stage("enroll"):
+        success, message, person_id = get_recognizer().add_person_from_bytes(
+            name, image_bytes, photo_path=photo_path
+        )
+    
+    # add_person_from_bytes removes the upload itself when it is rejected
+    # or duplicates an enrolled photo
+    if success:
+        launch_camera(person_id)
+    
+    return success, message
+
+
+def decode_base64_photo(photo_data):
+    """Bytes of a base64 photo, with or without a ``data:`` URL prefix"""
+    if ',' in photo_data:
+        photo_data = photo_data.split(',')[1]
+    return base64.b64decode(photo_data)
+
+
+def recognize_images(images):
+    """Recognize encoded photos in parallel; one JSON-ready dict per photo"""
+    results = []
+    for matches in get_recognizer().recognize_batch(images):
+        if matches is None:
+            results.append({'success': False, 'error': 'فشل قراءة الصورة'})
+        else:
+            faces = [match.to_dict() for match in matches]
+            results.append({'success': True, 'count': len(faces), 'faces': faces})
+    return results
+
+
+def new_upload_path(mimetype):
+    """Final data/photos path for an uploaded photo"""
+    from face_recognizer import new_photo_path
+    return new_photo_path(PHOTO_EXTENSIONS.get(mimetype, '.jpg'))
+
+
+def save_upload(stream, filepath):
+    """Copy a request stream to disk in chunks; returns the byte count"""
+    size = 0
+    try:
+        with metrics.stage("upload_save"), open(filepath, 'wb') as f:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        raise
+    
+    if size == 0:
+        os.remove(filepath)
+    return size
+
 @app.route('/')
 def index():
     return send_from_directory('.', 'index.html')
@@ -31,66 +193,190 @@ def serve_file(path):
 def submit_report():
     """
     Receive report data including photo
-    Save photo and launch camera recognition
+    Save photo and queue it for enrollment; the response returns at once
+    with a job id to poll on /api/report-status/<id>
     """
     try:
-        data = request.json
+        if request.mimetype == 'multipart/form-data':
+            name = request.form.get('name', 'Unknown')
+            upload = request.files.get('photo')
+            
+            if upload is None or not upload.filename:
+                return jsonify({'success': False, 'error': 'لم يتم رفع صورة'}), 400
+            
+            filepath = new_upload_path(upload.mimetype)
+            if save_upload(upload.stream, filepath) == 0:
+                return jsonify({'success': False, 'error': 'لم يتم رفع صورة'}), 400
+        
+        elif request.is_json:
+            # Legacy: base64 data URL inside JSON
+            data = request.json
+            name = data.get('name', 'Unknown')
+            photo_data = data.get('photo', '')
+            
+            if not photo_data:
+                return jsonify({'success': False, 'error': 'لم يتم رفع صورة'}), 400
+            
+            filepath = new_upload_path(None)
+            with open(filepath, 'wb') as f:
+                f.write(decode_base64_photo(photo_data))
+        
+        else:
+            # Raw image body, streamed to its final file
+            name = request.args.get('name', 'Unknown')
+            filepath = new_upload_path(request.mimetype)
+            if save_upload(request.stream, filepath) == 0:
+                return jsonify({'success': False, 'error': 'لم يتم رفع صورة'}), 400
         
-        # Get person data
-        name = data.get('name', 'Unknown')
-        photo_data = data.get('photo', '')
+        print(f"✓ تم حفظ صورة: {filepath}")
+        
+        # Detection, database insert and enrollment run in the background
+        with metrics.stage("queue_submit"):
+            job_id = get_report_queue().submit(name, filepath)
         
-        if not photo_data:
+        return jsonify({
+            'success': True,
+            'message': 'تم استلام البلاغ وجاري معالجته',
+            'name': name,
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/api/report-status/{job_id}'
+        }), 202
+        
+    except RequestEntityTooLarge:
+        return jsonify({'success': False, 'error': 'حجم الصورة كبير جداً'}), 413
+        
+    except Exception as e:
+        print(f"خطأ: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/report-status/<job_id>', methods=['GET'])
+def report_status(job_id):
+    """
+    Progress of a queued report: queued, processing, done or failed
+    (with the reason, e.g. no face or several faces in the photo)
+    """
+    try:
+        with metrics.stage("report_status"):
+            status = get_report_queue().status(job_id)
+        if status is None:
+            return jsonify({'success': False, 'error': 'البلاغ غير موجود'}), 404
+        
+        return jsonify({'success': True, **status})
+        
+    except Exception as e:
+        print(f"خطأ: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/recognize', methods=['POST'])
+def recognize_photo():
+    """
+    Identify the faces of one photo (raw body, multipart ``photo`` field
+    or base64 ``photo`` in JSON)
+    Returns the box, person id, name and distance of every face
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('photo')
+            image_bytes = upload.read() if upload is not None else b''
+        elif request.is_json:
+            image_bytes = decode_base64_photo(request.json.get('photo', ''))
+        else:
+            image_bytes = request.get_data()
+        
+        if not image_bytes:
             return jsonify({'success': False, 'error': 'لم يتم رفع صورة'}), 400
         
-        # Decode base64 image
-        if ',' in photo_data:
-            photo_data = photo_data.split(',')[1]
+        with metrics.stage("recognize_api"):
+            result = recognize_images([image_bytes])[0]
         
-        image_bytes = base64.b64decode(photo_data)
+        return jsonify(result), 200 if result['success'] else 400
         
-        # Save image
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{name}_{timestamp}.jpg"
-        filepath = os.path.join("data/photos", filename)
+    except RequestEntityTooLarge:
+        return jsonify({'success': False, 'error': 'حجم الصورة كبير جداً'}), 413
         
-        with open(filepath, 'wb') as f:
-            f.write(image_bytes)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'صورة غير صالحة'}), 400
         
-        print(f"✓ تم حفظ صورة: {filepath}")
+    except Exception as e:
+        print(f"خطأ: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/recognize-batch', methods=['POST'])
+def recognize_batch():
+    """
+    Identify the faces of many photos in one request (multipart ``photos``
+    fields or a base64 ``photos`` list in JSON), processed in parallel
+    Results are returned in the order of the photos
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            images = [upload.read() for upload in request.files.getlist('photos')]
+        elif request.is_json:
+            images = [decode_base64_photo(photo) for photo in request.json.get('photos', [])]
+        else:
+            images = []
         
-        # Add person to database using face_recognizer
-        from face_recognizer import FaceRecognizer
-        recognizer = FaceRecognizer()
-        success, message = recognizer.add_person_from_image(name, filepath)
+        if not images:
+            return jsonify({'success': False, 'error': 'لم يتم رفع صور'}), 400
         
-        if not success:
-            return jsonify({'success': False, 'error': message}), 400
+        if len(images) > RECOGNIZE_BATCH_LIMIT:
+            return jsonify({
+                'success': False,
+                'error': f'الحد الأقصى {RECOGNIZE_BATCH_LIMIT} صورة في الطلب الواحد'
+            }), 400
         
-        print(f"✓ تم إضافة الشخص: {name}")
+        with metrics.stage("recognize_batch_api"):
+            results = recognize_images(images)
         
-        # Launch camera recognition in a new process
-        try:
-            if sys.platform == 'win32':
-                subprocess.Popen(['python', 'camera_recognition.py'], 
-                               creationflags=subprocess.CREATE_NEW_CONSOLE)
-            else:
-                subprocess.Popen(['python3', 'camera_recognition.py'])
-            
-            print("✓ تم تشغيل نظام التعرف على الوجوه")
-        except Exception as e:
-            print(f"تحذير: فشل في تشغيل الكاميرا تلقائياً: {str(e)}")
+        return jsonify({'success': True, 'count': len(results), 'results': results})
         
-        return jsonify({
-            'success': True,
-            'message': 'تم إرسال البلاغ بنجاح وتشغيل نظام التعرف على الوجوه',
-            'name': name
-        })
+    except RequestEntityTooLarge:
+        return jsonify({'success': False, 'error': 'حجم الصور كبير جداً'}), 413
         
+    except ValueError:
+        return jsonify({'success': False, 'error': 'صورة غير صالحة'}), 400
+        
+    except Exception as e:
+        print(f"خطأ: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/reload-gallery', methods=['POST'])
+def reload_gallery():
+    """
+    Bring the shared recognizer in line with the database
+    Picks up people added or removed by other processes in place,
+    without reloading the whole gallery under the lock
+    """
+    try:
+        recognizer = get_recognizer()
+        added, removed = recognizer.sync_known_faces()
+        return jsonify({'success': True, 'count': len(recognizer.known_face_ids),
+                        'added': added, 'removed': removed})
+
     except Exception as e:
         print(f"خطأ: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Stage latencies (p50/p95/p99), frame counters and FPS in the
+    Prometheus text format, for this server and the camera process
+    """
+    if not metrics.ENABLED:
+        return Response("metrics disabled (FACE_METRICS=0)\n", status=404, mimetype='text/plain')
+    
+    from recognition_service import send_command
+    
+    snapshots = {'bridge': metrics.snapshot()}
+    reply = send_command('metrics', timeout=1.0)
+    if reply is not None and 'metrics' in reply:
+        snapshots['camera'] = reply['metrics']
+    
+    return Response(metrics.render_prometheus(snapshots),
+                    mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     print("=" * 60)
     print("🚀 تشغيل خادم منصة أبشر...")
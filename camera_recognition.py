@@ -3,17 +3,198 @@
 """
 نظام التعرف على الوجوه - منصة أبشر
 يعمل تلقائياً بعد إضافة بلاغ الشخص المفقود
+
+Runs as a single resident process: bridge.py notifies it of new reports
+through recognition_service instead of starting another copy, and the
+gallery is updated in place while the camera keeps running.
+
+The window comes up before OpenCV, NumPy and PIL are imported; the
+gallery is loaded on a background thread while the camera preview
+already runs, and the time to the first displayed frame is reported.
 """
 
-import cv2
+import functools
+import time
+
+# Reference point of the time-to-first-frame measurement
+STARTED = time.perf_counter()
+
 import tkinter as tk
 from tkinter import messagebox, ttk
-from PIL import Image, ImageTk
 import threading
-from face_recognizer import FaceRecognizer
+import queue
+from recognition_service import RecognitionService, send_command
+import metrics
 import sys
 import os
 
+# Face detection settings for the live feed. A DETECTION_SCALE below 1
+# runs the cascade on a downscaled frame (higher frame rate, fewer small
+# faces detected); MIN_FACE_SIZE is in full-resolution pixels.
+DETECTION_SCALE = 1.0
+DETECTION_SCALE_FACTOR = 1.1
+MIN_FACE_SIZE = (30, 30)
+
+# Full detection runs every DETECT_EVERY frames (faces are tracked in
+# between); a tracked face is re-identified every REIDENTIFY_EVERY frames
+DETECT_EVERY = 5
+REIDENTIFY_EVERY = 30
+
+# Size of the preview area and how often the Tk loop polls for a new frame
+DISPLAY_MAX_WIDTH = 1160
+DISPLAY_MAX_HEIGHT = 600
+DISPLAY_POLL_MS = 10
+
+# How often the Tk loop runs window commands received from bridge.py
+COMMAND_POLL_MS = 200
+
+# Opening the camera: how long to wait for a first frame and how often to
+# retry meanwhile (instead of fixed warm-up sleeps)
+CAMERA_INDEX = 0
+CAMERA_OPEN_TIMEOUT = 5.0
+CAMERA_POLL_INTERVAL = 0.05
+CAMERA_REOPEN_INTERVAL = 0.5
+
+# The camera starts on its own this long after the window is shown
+CAMERA_AUTOSTART_MS = 50
+
+
+class LatestFrameBuffer:
+    """Single-slot hand-off between threads that keeps only the newest item
+
+    A producer never blocks: putting a frame while the previous one has not
+    been consumed yet replaces it (and counts it as dropped).
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self.dropped = 0
+
+    def put(self, item):
+        """Store an item; returns the unconsumed item it replaced, if any"""
+        with self._condition:
+            replaced, self._item = self._item, item
+            if replaced is not None:
+                self.dropped += 1
+            self._condition.notify()
+            return replaced
+
+    def get(self, timeout=None):
+        """Wait for an item and take it; returns None on timeout"""
+        with self._condition:
+            if self._item is None:
+                self._condition.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def take(self):
+        """Take the current item without waiting (None if there is none)"""
+        with self._condition:
+            item, self._item = self._item, None
+            return item
+
+    def clear(self):
+        with self._condition:
+            self._item = None
+            self.dropped = 0
+
+
+class FramePool:
+    """Free lists of reusable uint8 frame buffers keyed by shape
+
+    Buffers travel from the capture thread to recognition and on to the Tk
+    loop, and are handed back with ``release`` once their last consumer is
+    done, so after the first few frames no frame-sized array is allocated.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free = {}
+
+    def acquire(self, shape):
+        with self._lock:
+            free = self._free.get(shape)
+            if free:
+                return free.pop()
+        import numpy as np
+        return np.empty(shape, dtype=np.uint8)
+
+    def release(self, buffer):
+        if buffer is None:
+            return
+        with self._lock:
+            self._free.setdefault(buffer.shape, []).append(buffer)
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+
+
+def open_camera(index=CAMERA_INDEX, timeout=CAMERA_OPEN_TIMEOUT, poll=CAMERA_POLL_INTERVAL):
+    """Open a capture device once it actually delivers frames
+
+    Returns ``(camera, first_frame)``, or ``(None, None)`` when no frame
+    arrived within ``timeout`` seconds. The device is polled every
+    ``poll`` seconds rather than given fixed warm-up sleeps, so a ready
+    camera is used at once. DirectShow is tried first on Windows.
+    """
+    import cv2
+
+    backends = [cv2.CAP_DSHOW, cv2.CAP_ANY] if sys.platform == 'win32' else [cv2.CAP_ANY]
+    deadline = time.perf_counter() + timeout
+
+    while True:
+        for backend in backends:
+            camera = cv2.VideoCapture(index, backend)
+            while camera.isOpened() and time.perf_counter() < deadline:
+                ret, frame = camera.read()
+                if ret and frame is not None:
+                    return camera, frame
+                time.sleep(poll)
+            camera.release()
+
+        if time.perf_counter() >= deadline:
+            return None, None
+        time.sleep(min(CAMERA_REOPEN_INTERVAL, max(0.0, deadline - time.perf_counter())))
+
+
+def read_frame(camera, pool, shape=None):
+    """Read the next frame into a pooled buffer of the expected shape
+
+    Returns ``(ret, frame)`` like ``VideoCapture.read``. When the camera
+    delivers another resolution OpenCV allocates a new frame, which then
+    joins the pool once released.
+    """
+    buffer = pool.acquire(shape) if shape else None
+    ret, frame = camera.read(image=buffer)
+    if frame is not buffer:
+        pool.release(buffer)
+    return ret, frame
+
+
+def display_frame(frame, pool, max_width=DISPLAY_MAX_WIDTH, max_height=DISPLAY_MAX_HEIGHT):
+    """Scaled RGB copy of a BGR frame in a pooled buffer
+
+    Resizing before the colour conversion gives the same pixels as the
+    other way round while converting fewer of them.
+    """
+    import cv2
+
+    height, width = frame.shape[:2]
+    scale = min(max_width / width, max_height / height)
+    new_width = int(width * scale)
+    new_height = int(height * scale)
+
+    rgb = pool.acquire((new_height, new_width, 3))
+    if (new_width, new_height) == (width, height):
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+    else:
+        cv2.resize(frame, (new_width, new_height), dst=rgb)
+        cv2.cvtColor(rgb, cv2.COLOR_BGR2RGB, dst=rgb)
+    return rgb
+
+
 class CameraRecognitionApp:
     def __init__(self, root):
         self.root = root
@@ -26,23 +207,95 @@ class CameraRecognitionApp:
         self.color_secondary = "#f4f4f4"
         self.color_white = "#ffffff"
         
-        # Initialize face recognizer
-        try:
-            self.recognizer = FaceRecognizer()
-            print("✓ تم تحميل نظام التعرف على الوجوه")
-        except Exception as e:
-            messagebox.showerror("خطأ", f"فشل في تحميل نظام التعرف: {str(e)}")
-            sys.exit(1)
+        # Face recognizer, built by load_gallery in the background; frames
+        # are shown without recognition until it is ready
+        self.recognizer = None
+        self.tracker = None
+        self.gallery_thread = None
         
         # Camera variables
         self.camera = None
         self.camera_running = False
-        self.camera_thread = None
+        self.capture_thread = None
+        self.recognition_thread = None
+        self.display_job = None
+        self.camera_started = None
+        self.first_frame_reported = False
+        self.launch_reported = False
+
+        # capture -> recognition -> Tk display, each stage only ever sees
+        # the newest frame of the previous one
+        self.frame_buffer = LatestFrameBuffer()
+        self.display_buffer = LatestFrameBuffer()
+        self.frame_pool = FramePool()
+        self.pending_status = None
+
+        # Reused by refresh_display until the preview size changes
+        self.display_image = None
+        self.display_photo = None
+
+        # Window commands from the service thread, run on the Tk thread
+        self.commands = queue.Queue()
+        self.service = RecognitionService({
+            'person_added': self.on_person_added,
+            'person_removed': self.on_person_removed,
+            'show': self.on_show,
+            'metrics': lambda message: {'metrics': metrics.snapshot()},
+        })
         
         # Create UI
         self.create_ui()
+        self.root.after(COMMAND_POLL_MS, self.poll_commands)
         
-        # Camera will be started by a button press
+        self.gallery_thread = threading.Thread(target=self.load_gallery, daemon=True)
+        self.gallery_thread.start()
+        self.root.after(CAMERA_AUTOSTART_MS, self.start_camera)
+        
+    def load_gallery(self):
+        """Background thread: import OpenCV, load the gallery and build the tracker"""
+        started = time.perf_counter()
+        try:
+            from face_recognizer import FaceRecognizer, FaceTracker
+            
+            recognizer = FaceRecognizer(
+                detection_scale=DETECTION_SCALE,
+                scale_factor=DETECTION_SCALE_FACTOR,
+                min_size=MIN_FACE_SIZE,
+                progress=self.on_gallery_progress
+            )
+            tracker = FaceTracker(
+                recognizer,
+                detect_every=DETECT_EVERY,
+                reidentify_every=REIDENTIFY_EVERY
+            )
+        except Exception as e:
+            print(f"✗ فشل في تحميل نظام التعرف: {str(e)}")
+            self.commands.put(functools.partial(self.gallery_failed, e))
+            return
+        
+        self.recognizer = recognizer
+        self.tracker = tracker
+        
+        # Reports enrolled while the gallery was being read
+        recognizer.sync_known_faces()
+        
+        elapsed = time.perf_counter() - started
+        metrics.observe("gallery_load", elapsed)
+        count = len(recognizer.known_face_ids)
+        print(f"✓ تم تحميل نظام التعرف على الوجوه ({count} شخص، {elapsed:.1f}s)")
+        self.set_status(f"✓ تم تحميل المعرض ({count} شخص)", "green")
+    
+    def on_gallery_progress(self, stage, done, total):
+        label = {
+            'load': "جاري تحميل المعرض",
+            'extract': "جاري استخراج الوجوه",
+            'train': "جاري تجهيز المعرض",
+        }.get(stage, "جاري تحميل المعرض")
+        self.set_status(f"⏳ {label} {done}/{total}", "#b26a00")
+    
+    def gallery_failed(self, error):
+        messagebox.showerror("خطأ", f"فشل في تحميل نظام التعرف: {str(error)}")
+        self.close_app()
         
     def create_ui(self):
         """Create the user interface"""
@@ -195,103 +448,102 @@ class CameraRecognitionApp:
         close_btn.pack(side=tk.LEFT, padx=10)
         
     def start_camera(self):
-        """Start camera automatically with retry mechanism"""
+        """Start the camera; it is opened on the capture thread"""
         if self.camera_running:
             return
-        
-        # Release any existing camera first
-        if self.camera is not None:
-            try:
-                self.camera.release()
-                cv2.destroyAllWindows()
-                threading.Event().wait(1)  # Wait 1 second
-            except:
-                pass
-            
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                print(f"محاولة فتح الكاميرا ({attempt + 1}/{max_retries})...")
-                
-                # Try DirectShow first (Windows)
-                self.camera = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-                
-                if not self.camera.isOpened():
-                    self.camera.release()
-                    threading.Event().wait(0.5)
-                    # Fallback to default
-                    self.camera = cv2.VideoCapture(0)
-                
-                # Add a small delay to allow the camera to warm up
-                if self.camera.isOpened():
-                    threading.Event().wait(1)
-                
-                if self.camera.isOpened():
-                    # Test if we can actually read from camera
-                    ret, test_frame = self.camera.read()
-                    if ret and test_frame is not None:
-                        print("✓ تم فتح الكاميرا بنجاح!")
-                        break
-                    else:
-                        print("✗ فشل في قراءة الكاميرا")
-                        self.camera.release()
-                        self.camera = None
-                else:
-                    print("✗ فشل في فتح الكاميرا")
-                    self.camera = None
-                
-                if attempt < max_retries - 1:
-                    threading.Event().wait(1)  # Wait before retry
-                    
-            except Exception as e:
-                print(f"خطأ: {str(e)}")
-                if self.camera:
-                    self.camera.release()
-                self.camera = None
-                if attempt < max_retries - 1:
-                    threading.Event().wait(1)
-        
-        if self.camera is None or not self.camera.isOpened():
-            error_msg = "فشل في فتح الكاميرا بعد 3 محاولات.\n\nالحلول:\n1. أغلقي جميع البرامج التي تستخدم الكاميرا\n2. أعيدي تشغيل الكمبيوتر\n3. تأكدي من تشغيل الكاميرا في برنامج آخر"
-            messagebox.showerror("خطأ", error_msg)
-            self.status_label.config(text="✗ فشل في فتح الكاميرا", fg="red")
-            self.camera_label.config(text="✗ فشل في فتح الكاميرا\n\nالرجاء إغلاق جميع البرامج التي تستخدم الكاميرا\nأو إعادة تشغيل الكمبيوتر")
+        if self.capture_thread is not None and self.capture_thread.is_alive():
+            # The previous capture thread is still opening the device
             return
         
-        # Camera opened successfully, configure it
+        self.camera_running = True
+        self.camera_started = time.perf_counter()
+        self.first_frame_reported = False
+        if self.tracker is not None:
+            self.tracker.reset()
+        self.frame_buffer.clear()
+        self.display_buffer.clear()
+        self.frame_pool.clear()
+        self.status_label.config(text="⏳ جاري فتح الكاميرا...")
+        
+        # Start capture and recognition threads; the Tk loop pulls the
+        # results itself so widgets are only touched from the main thread
+        self.capture_thread = threading.Thread(target=self.capture_loop, daemon=True)
+        self.recognition_thread = threading.Thread(target=self.recognition_loop, daemon=True)
+        self.capture_thread.start()
+        self.recognition_thread.start()
+        self.display_job = self.root.after(DISPLAY_POLL_MS, self.refresh_display)
+    
+    def open_camera(self):
+        """Capture thread: open the device, returns its first frame or None"""
+        print("جاري فتح الكاميرا...")
         try:
-            # Set camera properties to a more stable resolution (640x480)
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-            self.camera.set(cv2.CAP_PROP_FPS, 30)
-            
-            self.camera_running = True
-            self.status_label.config(text="✓ الكاميرا تعمل - جاري البحث عن الوجوه...")
-            
-            # Start camera thread
-            self.camera_thread = threading.Thread(target=self.update_camera, daemon=True)
-            self.camera_thread.start()
-            
-            print("✓ تم تشغيل الكاميرا")
-            
+            camera, frame = open_camera()
         except Exception as e:
-            print(f"خطأ في تهيئة الكاميرا: {str(e)}")
-            messagebox.showerror("خطأ", f"فشل في تشغيل الكاميرا: {str(e)}")
+            print(f"خطأ: {str(e)}")
+            camera, frame = None, None
+        
+        if camera is None:
+            print("✗ فشل في فتح الكاميرا")
+            self.camera_running = False
+            self.commands.put(self.camera_failed)
+            return None
+        
+        if not self.camera_running:
+            # Stopped while the device was opening
+            camera.release()
+            return None
+        
+        import cv2
+        
+        # Set camera properties to a more stable resolution (640x480)
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        camera.set(cv2.CAP_PROP_FPS, 30)
+        self.camera = camera
+        
+        print(f"✓ تم فتح الكاميرا بنجاح! ({time.perf_counter() - self.camera_started:.2f}s)")
+        if self.recognizer is None:
+            self.set_status("✓ الكاميرا تعمل - جاري تحميل المعرض...")
+        else:
+            self.set_status("✓ الكاميرا تعمل - جاري البحث عن الوجوه...")
+        return frame
+    
+    def camera_failed(self):
+        if self.display_job is not None:
+            self.root.after_cancel(self.display_job)
+            self.display_job = None
+        
+        error_msg = f"فشل في فتح الكاميرا خلال {CAMERA_OPEN_TIMEOUT:g} ثوان.\n\nالحلول:\n1. أغلقي جميع البرامج التي تستخدم الكاميرا\n2. أعيدي تشغيل الكمبيوتر\n3. تأكدي من تشغيل الكاميرا في برنامج آخر"
+        self.status_label.config(text="✗ فشل في فتح الكاميرا", fg="red")
+        self.camera_label.config(text="✗ فشل في فتح الكاميرا\n\nالرجاء إغلاق جميع البرامج التي تستخدم الكاميرا\nأو إعادة تشغيل الكمبيوتر")
+        messagebox.showerror("خطأ", error_msg)
     
-    def update_camera(self):
-        """Update camera feed"""
+    def set_status(self, text, fg=None):
+        """Queue a status message from a worker thread for the Tk loop"""
+        self.pending_status = (text, fg)
+
+    def capture_loop(self):
+        """Read frames as fast as the camera delivers them"""
         frame_count = 0
         error_count = 0
         max_errors = 10
+        frame_shape = None
+        
+        first = self.open_camera()
+        if first is None:
+            return
+        frame_shape = first.shape
+        self.frame_buffer.put(first)
         
         while self.camera_running:
             try:
                 if self.camera is None or not self.camera.isOpened():
                     print("✗ الكاميرا مغلقة")
-                    self.status_label.config(text="✗ الكاميرا مغلقة", fg="red")
+                    self.set_status("✗ الكاميرا مغلقة", "red")
                     break
                 
-                ret, frame = self.camera.read()
+                with metrics.stage("capture"):
+                    ret, frame = read_frame(self.camera, self.frame_pool, frame_shape)
                 
                 if not ret or frame is None:
                     error_count += 1
@@ -299,10 +551,10 @@ class CameraRecognitionApp:
                     
                     if error_count >= max_errors:
                         print("✗ تجاوز عدد الأخطاء المسموح")
-                        self.status_label.config(text="✗ فشل في قراءة الكاميرا", fg="red")
+                        self.set_status("✗ فشل في قراءة الكاميرا", "red")
                         break
                     
-                    threading.Event().wait(0.1)
+                    time.sleep(0.1)
                     continue
                 
                 # Reset error count on successful read
@@ -310,36 +562,59 @@ class CameraRecognitionApp:
                     error_count = 0
                 
                 frame_count += 1
+                frame_shape = frame.shape
                 if frame_count == 1:
                     print(f"✓ بدأ قراءة الإطارات بنجاح! (الحجم: {frame.shape})")
                 
-                # Recognize faces
-                frame = self.recognizer.recognize_faces_in_frame(frame)
-                
-                # Convert to RGB for Tkinter
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                metrics.count("frames_captured")
+                metrics.tick("frames_captured")
                 
-                # Resize to fit window
-                height, width = frame_rgb.shape[:2]
-                max_width = 1160
-                max_height = 600
+                # Never waits for recognition; a stale frame is replaced
+                # and its buffer goes back to the pool
+                dropped = self.frame_buffer.put(frame)
+                if dropped is not None:
+                    metrics.count("frames_dropped")
+                    self.frame_pool.release(dropped)
                 
-                scale = min(max_width/width, max_height/height)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                
-                frame_resized = cv2.resize(frame_rgb, (new_width, new_height))
+            except Exception as e:
+                error_count += 1
+                print(f"خطأ في قراءة الكاميرا: {str(e)}")
                 
-                # Convert to PhotoImage
-                img = Image.fromarray(frame_resized)
-                imgtk = ImageTk.PhotoImage(image=img)
+                if error_count >= max_errors:
+                    print("✗ تجاوز عدد الأخطاء المسموح")
+                    break
                 
-                # Update label and explicitly retain reference to prevent garbage collection
-                self.camera_label.imgtk = imgtk # Retain reference
-                self.camera_label.configure(image=imgtk, text="")
+                time.sleep(0.1)
+        
+        print("✗ تم إيقاف thread الكاميرا")
+    
+    def recognition_loop(self):
+        """Recognize faces on the newest captured frame and prepare it for display"""
+        error_count = 0
+        max_errors = 10
+        
+        while self.camera_running:
+            frame = self.frame_buffer.get(timeout=0.1)
+            if frame is None:
+                continue
+            
+            try:
+                # Recognize faces (tracked between detections); labels are
+                # drawn on the captured frame in place
+                # Until the gallery is loaded frames are shown as captured
+                tracker = self.tracker
+                if tracker is not None:
+                    with metrics.stage("recognize"):
+                        frame = tracker.process(frame)
                 
-                # Small delay
-                threading.Event().wait(0.03)
+                # Scaled RGB copy for Tkinter
+                with metrics.stage("resize"):
+                    rgb = display_frame(frame, self.frame_pool)
+                dropped = self.display_buffer.put(rgb)
+                if dropped is not None:
+                    metrics.count("frames_not_displayed")
+                    self.frame_pool.release(dropped)
+                error_count = 0
                 
             except Exception as e:
                 error_count += 1
@@ -350,10 +625,70 @@ class CameraRecognitionApp:
                 if error_count >= max_errors:
                     print("✗ تجاوز عدد الأخطاء المسموح")
                     break
-                
-                threading.Event().wait(0.1)
+            
+            finally:
+                self.frame_pool.release(frame)
         
-        print("✗ تم إيقاف thread الكاميرا")
+        print("✗ تم إيقاف thread التعرف")
+    
+    def apply_pending_status(self):
+        if self.pending_status is not None:
+            text, fg = self.pending_status
+            self.pending_status = None
+            if fg:
+                self.status_label.config(text=text, fg=fg)
+            else:
+                self.status_label.config(text=text)
+    
+    def refresh_display(self):
+        """Tk main loop side: show the newest processed frame"""
+        self.display_job = None
+        self.apply_pending_status()
+        
+        frame = self.display_buffer.take()
+        if frame is not None:
+            with metrics.stage("tk_update"):
+                self.show_frame(frame)
+            metrics.count("frames_displayed")
+            metrics.tick("frames_displayed")
+            self.frame_pool.release(frame)
+            if not self.first_frame_reported:
+                self.report_first_frame()
+        
+        if self.camera_running:
+            self.display_job = self.root.after(DISPLAY_POLL_MS, self.refresh_display)
+    
+    def report_first_frame(self):
+        """Log and record how long the first frame took to reach the screen"""
+        self.first_frame_reported = True
+        now = time.perf_counter()
+        since_camera = now - self.camera_started
+        metrics.observe("first_frame", since_camera)
+        
+        # Only the first start of the process counts as time to first frame
+        if not self.launch_reported:
+            self.launch_reported = True
+            since_launch = now - STARTED
+            metrics.observe("time_to_first_frame", since_launch)
+            print(f"✓ أول إطار بعد {since_launch:.2f}s من التشغيل "
+                  f"({since_camera:.2f}s من فتح الكاميرا)")
+        else:
+            print(f"✓ أول إطار بعد {since_camera:.2f}s من فتح الكاميرا")
+    
+    def show_frame(self, frame):
+        """Copy an RGB frame into the preview, reusing the same PhotoImage"""
+        from PIL import Image, ImageTk
+        
+        height, width = frame.shape[:2]
+        if self.display_image is None or self.display_image.size != (width, height):
+            self.display_image = Image.new("RGB", (width, height))
+            self.display_photo = ImageTk.PhotoImage(image=self.display_image)
+            # The label only keeps the Tk name; keep the Python object alive
+            self.camera_label.imgtk = self.display_photo
+            self.camera_label.configure(image=self.display_photo, text="")
+        
+        self.display_image.frombytes(frame)
+        self.display_photo.paste(self.display_image)
     
     def stop_camera(self):
         """Stop the camera feed and release resources"""
@@ -362,12 +697,17 @@ class CameraRecognitionApp:
             
         print("جاري إيقاف الكاميرا...")
         
-        # Stop camera thread
+        # Stop camera threads
         self.camera_running = False
         
-        # Wait for thread to finish
-        if self.camera_thread and self.camera_thread.is_alive():
-            self.camera_thread.join(timeout=2)
+        if self.display_job is not None:
+            self.root.after_cancel(self.display_job)
+            self.display_job = None
+        
+        # Wait for threads to finish
+        for thread in (self.capture_thread, self.recognition_thread):
+            if thread and thread.is_alive():
+                thread.join(timeout=2)
         
         # Release camera
         if self.camera:
@@ -380,20 +720,82 @@ class CameraRecognitionApp:
         
         # Update UI
         self.camera_label.configure(image='', text="الكاميرا متوقفة")
+        self.display_image = None
+        self.display_photo = None
         self.status_label.config(text="✗ الكاميرا متوقفة", fg="red")
         
-        # Destroy all OpenCV windows
-        try:
-            cv2.destroyAllWindows()
-        except:
-            pass
-        
         print("✓ تم إيقاف الكاميرا")
     
+    # -----------------------------------------------------
+    # أوامر bridge.py (تعمل على خيط الخدمة)
+    # -----------------------------------------------------
+    def on_person_added(self, message):
+        """Enroll new people without reloading the gallery"""
+        if self.recognizer is None:
+            # load_gallery syncs with the database once it is done
+            return {'added': 0, 'loading': True}
+        
+        person_ids = message.get('person_ids')
+        if person_ids:
+            added = self.recognizer.add_known_people(person_ids)
+        else:
+            added, _ = self.recognizer.sync_known_faces()
+
+        if added:
+            print(f"✓ تمت إضافة {added} شخص إلى المعرض")
+            self.set_status(f"✓ تمت إضافة {added} شخص إلى قائمة البحث", fg="green")
+        return {'added': added, 'count': len(self.recognizer.known_face_ids)}
+
+    def on_person_removed(self, message):
+        """Drop deleted people from the gallery"""
+        if self.recognizer is None:
+            return {'removed': 0, 'loading': True}
+        
+        person_ids = message.get('person_ids')
+        if person_ids:
+            removed = self.recognizer.forget_people(person_ids)
+        else:
+            _, removed = self.recognizer.sync_known_faces()
+
+        if removed:
+            print(f"✓ تمت إزالة {removed} شخص من المعرض")
+        return {'removed': removed, 'count': len(self.recognizer.known_face_ids)}
+
+    def on_show(self, message):
+        self.commands.put(self.raise_window)
+        return {}
+
+    def poll_commands(self):
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            # One failing command must not stop the polling
+            try:
+                command()
+            except Exception as e:
+                print(f"خطأ في تنفيذ أمر: {str(e)}")
+
+        try:
+            # refresh_display shows status updates while the camera runs
+            if not self.camera_running:
+                self.apply_pending_status()
+            self.root.after(COMMAND_POLL_MS, self.poll_commands)
+        except tk.TclError:
+            # The window was closed by one of the commands
+            pass
+
+    def raise_window(self):
+        self.root.deiconify()
+        self.root.lift()
+        self.root.focus_force()
+
     def close_app(self):
         """Close the application properly"""
         print("جاري إغلاق النظام...")
         
+        self.service.stop()
         self.stop_camera()
         
         # Unbind mousewheel before destroying
@@ -411,9 +813,18 @@ class CameraRecognitionApp:
             pass
 
 def main():
+    # Only one copy owns the camera; bring the running one forward instead
+    if send_command('show') is not None:
+        print("✓ نظام التعرف يعمل بالفعل")
+        return
+
     root = tk.Tk()
     app = CameraRecognitionApp(root)
     root.protocol("WM_DELETE_WINDOW", app.close_app)
+    if not app.service.start():
+        print("تحذير: نسخة أخرى من نظام التعرف تعمل بالفعل")
+        app.close_app()
+        return
     root.mainloop()
 
 if __name__ == "__main__":
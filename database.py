@@ -1,102 +1,543 @@
 import sqlite3
 import os
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
+# Idle connections kept open by each Database
+POOL_SIZE = 4
+
+# Rows fetched per round trip when streaming, and ids per IN (...) query
+FETCH_BATCH = 500
+
+# Applied to every pooled connection. WAL lets readers run next to a
+# writer; with WAL, synchronous=NORMAL is still safe against corruption.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 67108864",
+    "PRAGMA foreign_keys = ON",
+)
+
+# Row layout of face_templates as written by save_face_templates
+TEMPLATE_INSERT = """
+    INSERT OR REPLACE INTO face_templates
+        (person_id, template_version, detector, photo_mtime_ns, photo_size,
+         width, height, face)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Schema changes, applied in order by init_database. The number of
+# migrations already applied is stored in PRAGMA user_version; never edit
+# a released migration, append a new one instead.
+MIGRATIONS = (
+    # 1: people table (databases created before versioning already have
+    # it, hence IF NOT EXISTS)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS people (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            photo_path TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # get_all_people / iter_people read in created_at order
+        """
+        CREATE INDEX IF NOT EXISTS idx_people_created_at
+        ON people (created_at)
+        """,
+    ),
+    # 2: normalized face crop of each person, so the gallery can be loaded
+    # without decoding photos. The photo mtime/size tell whether the crop
+    # still matches the photo on disk.
+    (
+        """
+        CREATE TABLE face_templates (
+            person_id INTEGER PRIMARY KEY REFERENCES people (id) ON DELETE CASCADE,
+            template_version INTEGER NOT NULL,
+            detector TEXT NOT NULL,
+            photo_mtime_ns INTEGER,
+            photo_size INTEGER,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            face BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ),
+    # 3: durable queue of submitted reports waiting to be enrolled
+    (
+        """
+        CREATE TABLE report_jobs (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            photo_path TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            message TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX idx_report_jobs_status
+        ON report_jobs (status)
+        """,
+    ),
+    # 4: hashes of each enrolled photo for duplicate detection. The 64-bit
+    # perceptual hash of the image is also split into four 16-bit bands:
+    # two hashes within 3 bits of each other share at least one band, so
+    # near-duplicate candidates come from an index lookup, not a scan.
+    (
+        """
+        CREATE TABLE photo_hashes (
+            person_id INTEGER PRIMARY KEY REFERENCES people (id) ON DELETE CASCADE,
+            content_hash TEXT NOT NULL,
+            image_hash INTEGER NOT NULL,
+            face_hash INTEGER NOT NULL,
+            image_band0 INTEGER NOT NULL,
+            image_band1 INTEGER NOT NULL,
+            image_band2 INTEGER NOT NULL,
+            image_band3 INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX idx_photo_hashes_content ON photo_hashes (content_hash)",
+        "CREATE INDEX idx_photo_hashes_band0 ON photo_hashes (image_band0)",
+        "CREATE INDEX idx_photo_hashes_band1 ON photo_hashes (image_band1)",
+        "CREATE INDEX idx_photo_hashes_band2 ON photo_hashes (image_band2)",
+        "CREATE INDEX idx_photo_hashes_band3 ON photo_hashes (image_band3)",
+    ),
+    # 5: face templates without a face (width, height and face NULL) record
+    # photos the detector found no face in, so they are not decoded again
+    # until the photo changes. SQLite cannot drop NOT NULL in place.
+    (
+        """
+        CREATE TABLE face_templates_new (
+            person_id INTEGER PRIMARY KEY REFERENCES people (id) ON DELETE CASCADE,
+            template_version INTEGER NOT NULL,
+            detector TEXT NOT NULL,
+            photo_mtime_ns INTEGER,
+            photo_size INTEGER,
+            width INTEGER,
+            height INTEGER,
+            face BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "INSERT INTO face_templates_new SELECT * FROM face_templates",
+        "DROP TABLE face_templates",
+        "ALTER TABLE face_templates_new RENAME TO face_templates",
+    ),
+)
+
+
+def hash_bands(value):
+    """Split a 64-bit hash into its four 16-bit bands (high to low)"""
+    value &= 0xFFFFFFFFFFFFFFFF
+    return tuple((value >> shift) & 0xFFFF for shift in (48, 32, 16, 0))
+
+
+def to_signed64(value):
+    """Unsigned 64-bit hash as the signed integer SQLite can store"""
+    value &= 0xFFFFFFFFFFFFFFFF
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class ConnectionPool:
+    """Thread-safe pool of persistent SQLite connections
+
+    A connection is used by one thread at a time and returned to the pool
+    afterwards. Connections inherited through fork are never reused.
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE, timeout=30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                               check_same_thread=False, isolation_level=None)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = queue.LifoQueue(maxsize=self._idle.maxsize)
+                self._pid = os.getpid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction or self._pid != os.getpid():
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
 class Database:
-    def __init__(self, db_path="data/face_recognition.db"):
+    def __init__(self, db_path="data/face_recognition.db", pool_size=POOL_SIZE):
         """Initialize database connection"""
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path, pool_size)
         self.init_database()
-    
+
+    @contextmanager
     def get_connection(self):
-        """Get database connection"""
-        return sqlite3.connect(self.db_path)
-    
+        """Borrow a pooled connection (autocommit; see ``transaction``)"""
+        conn = self.pool.acquire()
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Pooled connection inside one write transaction"""
+        with self.get_connection() as conn:
+            # Take the write lock up front so concurrent writers queue on
+            # busy_timeout instead of failing halfway through
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        """Close the idle pooled connections"""
+        self.pool.close()
+
+    def schema_version(self):
+        with self.get_connection() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
     def init_database(self):
-        """Create tables if they don't exist"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Create people table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS people (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                photo_path TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
-        conn.close()
-    
+        """Create or upgrade the schema by running the pending migrations"""
+        if self.schema_version() >= len(MIGRATIONS):
+            return
+
+        # Each migration is its own transaction; the version is re-read
+        # under the write lock in case another process migrated first
+        for version, statements in enumerate(MIGRATIONS, start=1):
+            with self.transaction() as conn:
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version}")
+
     def add_person(self, name, photo_path):
         """Add a new person to the database"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO people (name, photo_path)
-            VALUES (?, ?)
-        """, (name, photo_path))
-        
-        person_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
+        return self.add_people([(name, photo_path)])[0]
+
+    def add_people(self, people):
+        """Add several (name, photo_path) pairs in one transaction
+
+        Returns the new ids in the order of ``people``.
+        """
+        people = list(people)
+        if not people:
+            return []
+
+        with self.transaction() as conn:
+            conn.executemany("""
+                INSERT INTO people (name, photo_path)
+                VALUES (?, ?)
+            """, people)
+            # The write lock is held for the whole transaction, so the
+            # AUTOINCREMENT ids of the batch are consecutive
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+        return list(range(last_id - len(people) + 1, last_id + 1))
+
+    def enroll_person(self, name, photo_path, hashes, template):
+        """Add a person with their photo hashes and face template atomically
+
+        ``hashes`` is (content_hash, image_hash, face_hash) as taken by
+        ``add_photo_hash`` and ``template`` a ``save_face_templates`` row
+        without its person_id. Either all three are stored or none, so a
+        failed enrollment cannot leave a person that duplicate detection
+        does not know about. Returns the new id.
+        """
+        with self.transaction() as conn:
+            person_id = conn.execute("""
+                INSERT INTO people (name, photo_path)
+                VALUES (?, ?)
+            """, (name, photo_path)).lastrowid
+            self._insert_photo_hash(conn, person_id, *hashes)
+            conn.execute(TEMPLATE_INSERT, (person_id, *template))
         return person_id
-    
-    def get_all_people(self):
-        """Get all people from the database"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
+
+    def _stream(self, query, batch_size):
+        """Yield the rows of a query, fetching ``batch_size`` at a time"""
+        with self.get_connection() as conn:
+            cursor = conn.execute(query)
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                cursor.close()
+
+    def iter_people(self, batch_size=FETCH_BATCH):
+        """Stream people (newest first) without loading the whole table"""
+        return self._stream("""
             SELECT id, name, photo_path, created_at
             FROM people
             ORDER BY created_at DESC
-        """)
-        
-        people = cursor.fetchall()
-        conn.close()
-        
-        return people
-    
+        """, batch_size)
+
+    def get_all_people(self):
+        """Get all people from the database"""
+        return list(self.iter_people())
+
     def delete_person(self, person_id):
         """Delete a person from the database"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Get photo path before deleting
-        cursor.execute("SELECT photo_path FROM people WHERE id = ?", (person_id,))
-        result = cursor.fetchone()
-        
-        if result:
-            photo_path = result[0]
-            
-            # Delete from database
-            cursor.execute("DELETE FROM people WHERE id = ?", (person_id,))
-            conn.commit()
-            
-            # Delete photo file
+        return person_id in self.delete_people([person_id])
+
+    def delete_people(self, person_ids):
+        """Delete several people and their photos in one transaction
+
+        Returns the ids that existed and were deleted.
+        """
+        person_ids = list(dict.fromkeys(person_ids))
+        found = []
+
+        with self.transaction() as conn:
+            # Get photo paths before deleting
+            for start in range(0, len(person_ids), FETCH_BATCH):
+                chunk = person_ids[start:start + FETCH_BATCH]
+                placeholders = ", ".join("?" * len(chunk))
+                found.extend(conn.execute(
+                    f"SELECT id, photo_path FROM people WHERE id IN ({placeholders})",
+                    chunk
+                ).fetchall())
+
+            conn.executemany("DELETE FROM people WHERE id = ?",
+                             [(person_id,) for person_id, _ in found])
+
+        # Delete photo files once the rows are gone
+        for _, photo_path in found:
             if os.path.exists(photo_path):
                 os.remove(photo_path)
-        
-        conn.close()
-        return result is not None
-    
+
+        return [person_id for person_id, _ in found]
+
+    def save_face_templates(self, templates):
+        """Insert or replace face templates in one transaction
+
+        ``templates`` holds (person_id, template_version, detector,
+        photo_mtime_ns, photo_size, width, height, face_bytes) tuples.
+        """
+        templates = list(templates)
+        if not templates:
+            return
+
+        with self.transaction() as conn:
+            conn.executemany(TEMPLATE_INSERT, templates)
+
+    def iter_gallery(self, batch_size=FETCH_BATCH):
+        """Stream every person with their face template (newest first)
+
+        Rows are (id, name, photo_path, template_version, photo_mtime_ns,
+        photo_size, width, height, face); the template columns are None for
+        people without a stored template, and width/height/face are None
+        when no face was found in the photo.
+        """
+        return self._stream("""
+            SELECT p.id, p.name, p.photo_path,
+                   t.template_version, t.photo_mtime_ns, t.photo_size,
+                   t.width, t.height, t.face
+            FROM people p
+            LEFT JOIN face_templates t ON t.person_id = p.id
+            ORDER BY p.created_at DESC
+        """, batch_size)
+
+    def count_face_templates(self):
+        """{template_version: number of people}, None for people without a face crop"""
+        with self.get_connection() as conn:
+            return dict(conn.execute("""
+                SELECT CASE WHEN t.face IS NULL THEN NULL ELSE t.template_version END AS version,
+                       COUNT(*)
+                FROM people p
+                LEFT JOIN face_templates t ON t.person_id = p.id
+                GROUP BY version
+            """).fetchall())
+
+    def get_person_ids(self):
+        """Ids of every person (reads only the primary key index)"""
+        with self.get_connection() as conn:
+            return [row[0] for row in conn.execute("SELECT id FROM people")]
+
+    def get_face_templates(self, person_ids):
+        """(id, name, template_version, width, height, face) of the given people
+
+        People without a stored face crop are left out.
+        """
+        person_ids = list(person_ids)
+        rows = []
+        with self.get_connection() as conn:
+            for start in range(0, len(person_ids), FETCH_BATCH):
+                chunk = person_ids[start:start + FETCH_BATCH]
+                placeholders = ", ".join("?" * len(chunk))
+                rows.extend(conn.execute(f"""
+                    SELECT p.id, p.name, t.template_version, t.width, t.height, t.face
+                    FROM people p
+                    JOIN face_templates t ON t.person_id = p.id
+                    WHERE p.id IN ({placeholders}) AND t.face IS NOT NULL
+                """, chunk).fetchall())
+        return rows
+
     def get_person_by_id(self, person_id):
         """Get a specific person by ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT id, name, photo_path, created_at
-            FROM people
-            WHERE id = ?
-        """, (person_id,))
-        
-        person = cursor.fetchone()
-        conn.close()
-        
-        return person
+        with self.get_connection() as conn:
+            return conn.execute("""
+                SELECT id, name, photo_path, created_at
+                FROM people
+                WHERE id = ?
+            """, (person_id,)).fetchone()
+
+    def add_report_job(self, job_id, name, photo_path):
+        """Queue a submitted report for enrollment"""
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT INTO report_jobs (id, name, photo_path)
+                VALUES (?, ?, ?)
+            """, (job_id, name, photo_path))
+
+    def claim_report_job(self):
+        """Mark the oldest queued job as processing and return it
+
+        Returns (id, name, photo_path, attempts) or None when the queue is
+        empty. The write transaction makes the claim atomic between
+        workers and processes.
+        """
+        with self.get_connection() as conn:
+            # Cheap read first so idle workers do not take the write lock
+            if conn.execute(
+                "SELECT 1 FROM report_jobs WHERE status = 'queued' LIMIT 1"
+            ).fetchone() is None:
+                return None
+
+        with self.transaction() as conn:
+            job = conn.execute("""
+                SELECT id, name, photo_path, attempts + 1
+                FROM report_jobs
+                WHERE status = 'queued'
+                ORDER BY rowid
+                LIMIT 1
+            """).fetchone()
+            if job is not None:
+                conn.execute("""
+                    UPDATE report_jobs
+                    SET status = 'processing', attempts = attempts + 1,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (job[0],))
+            return job
+
+    def finish_report_job(self, job_id, status, message=None):
+        """Record the outcome ('done' or 'failed') of a job"""
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE report_jobs
+                SET status = ?, message = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (status, message, job_id))
+
+    def requeue_report_jobs(self, max_attempts, lease, message=None):
+        """Put jobs abandoned in 'processing' by a crash back in the queue
+
+        Only jobs claimed more than ``lease`` seconds ago count as
+        abandoned; younger ones may still be running in another process.
+        Jobs that already used ``max_attempts`` are failed with ``message``
+        instead. Returns the number of requeued jobs.
+        """
+        expired = f"-{int(lease)} seconds"
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE report_jobs
+                SET status = 'failed', message = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'processing' AND attempts >= ?
+                  AND updated_at < datetime('now', ?)
+            """, (message, max_attempts, expired))
+            return conn.execute("""
+                UPDATE report_jobs
+                SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'processing' AND updated_at < datetime('now', ?)
+            """, (expired,)).rowcount
+
+    def get_report_job(self, job_id):
+        """(id, name, status, message, attempts, created_at, updated_at) of a job"""
+        with self.get_connection() as conn:
+            return conn.execute("""
+                SELECT id, name, status, message, attempts, created_at, updated_at
+                FROM report_jobs
+                WHERE id = ?
+            """, (job_id,)).fetchone()
+
+    def add_photo_hash(self, person_id, content_hash, image_hash, face_hash):
+        """Index the hashes of a person's photo (hashes are unsigned 64-bit)"""
+        with self.transaction() as conn:
+            self._insert_photo_hash(conn, person_id, content_hash, image_hash, face_hash)
+
+    @staticmethod
+    def _insert_photo_hash(conn, person_id, content_hash, image_hash, face_hash):
+        conn.execute("""
+            INSERT OR REPLACE INTO photo_hashes
+                (person_id, content_hash, image_hash, face_hash,
+                 image_band0, image_band1, image_band2, image_band3)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (person_id, content_hash, to_signed64(image_hash), to_signed64(face_hash),
+              *hash_bands(image_hash)))
+
+    def find_photo_hashes(self, content_hash, image_hash=None):
+        """Indexed photos with the same content hash or sharing an image band
+
+        Returns (person_id, name, content_hash, image_hash, face_hash) rows
+        with unsigned hashes; the caller checks the actual distances.
+        """
+        query = """
+            SELECT h.person_id, p.name, h.content_hash, h.image_hash, h.face_hash
+            FROM photo_hashes h
+            JOIN people p ON p.id = h.person_id
+            WHERE h.content_hash = ?
+        """
+        params = [content_hash]
+        if image_hash is not None:
+            query += """
+                OR h.image_band0 = ? OR h.image_band1 = ?
+                OR h.image_band2 = ? OR h.image_band3 = ?
+            """
+            params.extend(hash_bands(image_hash))
+
+        with self.get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        mask = 0xFFFFFFFFFFFFFFFF
+        return [(person_id, name, content, image & mask, face & mask)
+                for person_id, name, content, image, face in rows]
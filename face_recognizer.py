@@ -1,131 +1,638 @@
 import cv2
 import numpy as np
 import os
-import pickle
+import json
+import hashlib
 from database import Database
-from PIL import Image, ImageDraw, ImageFont
-import arabic_reshaper
-from bidi.algorithm import get_display
+from gallery_matcher import GalleryMatcher
+from ann_index import IVFIndex
+import metrics
 import uuid
-import shutil
+import queue
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Bump whenever the crop extraction or LBPH parameters change so stale
+# face templates and gallery histograms are rebuilt instead of being reused
+# (see template_face for upgrading old templates without the photos).
+# 2: crops are histogram-equalized
+CACHE_VERSION = 2
+CACHE_DIR = "data/cache"
+PHOTOS_DIR = "data/photos"
+FACE_SIZE = (200, 200)
+
+# Largest Hamming distances (of 64 bits) between the perceptual hashes of
+# two photos for them to be treated as the same picture (resized or
+# recompressed). The image bound must stay below 4 for the banded index in
+# the database to find every candidate; the face crop gets more slack since
+# the detected box shifts by a few pixels between copies.
+DUPLICATE_IMAGE_BITS = 3
+DUPLICATE_FACE_BITS = 10
+
+# Largest LBPH chi-square distance at which a face is taken to be the
+# gallery person it is closest to
+MATCH_DISTANCE = 100
+
+# Gallery loading reports its progress every PROGRESS_STEP people
+PROGRESS_STEP = 256
+
+# Rendered name labels kept for reuse (a handful of names are on screen)
+LABEL_CACHE_SIZE = 256
+LABEL_FONT_SIZE = 24
+
+
+def dhash(gray):
+    """64-bit difference hash of a grayscale image
+
+    Compares neighbouring pixels of a 9x8 thumbnail, so it survives
+    resizing and recompression but changes with the picture content.
+    """
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def normalize_face(face):
+    """Scale a gray face crop to FACE_SIZE and equalize its histogram
+
+    Stored templates and faces found in frames both go through this, so
+    lighting differences between phone photos and the camera are evened
+    out the same way on both sides.
+    """
+    if face.shape[:2] != (FACE_SIZE[1], FACE_SIZE[0]):
+        face = cv2.resize(face, FACE_SIZE)
+    return cv2.equalizeHist(face)
+
+
+def crop_face(gray, box):
+    """Normalized crop of an (x, y, w, h) box of a gray image"""
+    x, y, w, h = box
+    return normalize_face(gray[y:y + h, x:x + w])
+
+
+def template_face(version, width, height, blob):
+    """Face crop of a stored template in the current format, or None
+
+    Version 1 templates hold the plain resized crop and only lack the
+    equalization; other versions have to be extracted from the photo again.
+    """
+    if blob is None:
+        return None
+    face = np.frombuffer(blob, dtype=np.uint8).reshape(height, width)
+    if version == CACHE_VERSION:
+        return face
+    if version == 1:
+        return normalize_face(face)
+    return None
+
+
+def _with_progress(items, progress, stage, total):
+    """Yield ``items``, calling ``progress(stage, done, total)`` now and then"""
+    done = 0
+    for done, item in enumerate(items, 1):
+        if progress is not None and done % PROGRESS_STEP == 0:
+            progress(stage, done, max(done, total))
+        yield item
+    if progress is not None:
+        progress(stage, done, max(done, total))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def new_photo_path(extension=".jpg"):
+    """New random file name under data/photos for a person's photo"""
+    return os.path.join(PHOTOS_DIR, str(uuid.uuid4())[:8] + extension)
+
+
+class Match:
+    """A face found by FaceRecognizer.recognize
+
+    ``person_id`` and ``name`` are None when nobody in the gallery is
+    within MATCH_DISTANCE; ``distance`` is then still that of the closest
+    person (None when the gallery is empty).
+    """
+
+    def __init__(self, box, person_id=None, name=None, distance=None):
+        self.box = tuple(int(v) for v in box)
+        self.person_id = person_id
+        self.name = name
+        self.distance = distance
+
+    @property
+    def confidence(self):
+        if self.person_id is None:
+            return 0
+        return MATCH_DISTANCE - self.distance
+
+    def to_dict(self):
+        x, y, w, h = self.box
+        return {
+            "box": {"x": x, "y": y, "width": w, "height": h},
+            "person_id": self.person_id,
+            "name": self.name,
+            "distance": self.distance,
+            "confidence": self.confidence,
+        }
+
+    def __repr__(self):
+        return f"Match(box={self.box}, person_id={self.person_id}, distance={self.distance})"
 
 
 class FaceRecognizer:
-    def __init__(self):
-        """Initialize face recognizer using OpenCV"""
+    def __init__(self, cache_dir=CACHE_DIR, workers=None, ann_probes=None, ann_lists=None,
+                 detection_scale=1.0, scale_factor=1.1, min_size=(30, 30), snapshot=None,
+                 progress=None):
+        """Initialize face recognizer using OpenCV
+
+        ``workers`` is the number of threads used to decode photos and
+        detect faces while loading the gallery (defaults to the CPU count,
+        1 loads serially).
+
+        ``ann_probes`` enables the approximate IVF index for large
+        galleries: each face is only compared with the people in its
+        ``ann_probes`` closest clusters (more probes = better recall,
+        slower). ``ann_lists`` sets the number of clusters (default
+        sqrt(gallery size)). Leave ``ann_probes`` unset for exact search.
+
+        ``detection_scale``, ``scale_factor`` and ``min_size`` tune face
+        detection on video frames: with a scale below 1 the cascade runs on
+        a downscaled copy of the frame (faster, misses more small faces)
+        while recognition still uses the full-resolution crop. ``min_size``
+        is in full-resolution pixels.
+
+        ``snapshot`` is a directory written by ``save_snapshot``; the
+        gallery is then memory-mapped from it (read-only) instead of being
+        loaded from the database.
+
+        ``progress`` is passed on to ``load_known_faces``.
+        """
         self.db = Database()
+        self.workers = workers or os.cpu_count() or 1
+        self.ann_probes = ann_probes
+        self.ann_lists = ann_lists
+        self.detection_scale = detection_scale
+        self.scale_factor = scale_factor
+        self.min_size = tuple(min_size)
 
         # Load Haar Cascade for face detection
-        cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        self.face_cascade = cv2.CascadeClassifier(cascade_path)
+        self.cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        self.face_cascade = cv2.CascadeClassifier(self.cascade_path)
 
-        # Create LBPH Face Recognizer
-        self.recognizer = cv2.face.LBPHFaceRecognizer_create()
+        # CascadeClassifier is not safe to share between threads. Idle
+        # classifiers wait in a pool rather than per thread: request and
+        # batch threads are short-lived and parsing the XML takes ~25 ms
+        self._cascades = queue.LifoQueue()
+        self._cascades.put(self.face_cascade)
+        self._thread_local = threading.local()
+
+        # LBPH-compatible matcher holding every gallery histogram
+        self.recognizer = GalleryMatcher()
+
+        # On-disk cache of the gallery histograms (face crops are stored in
+        # the database as templates)
+        self.cache_dir = cache_dir
+        self.model_path = os.path.join(cache_dir, f"gallery_v{CACHE_VERSION}.npz")
+        os.makedirs(cache_dir, exist_ok=True)
 
         # Known faces
         self.known_face_ids = []
         self.known_face_names = {}
+        self.face_templates = {}
         self.is_trained = False
 
-        self.load_known_faces()
+        # Guards the model and the known-face tables so one instance can be
+        # shared between request handlers and the camera thread
+        self.lock = threading.RLock()
+
+        # Fonts and pre-rendered label sprites for draw_arabic_text
+        self._fonts = {}
+        self._label_cache = OrderedDict()
+        self._label_lock = threading.Lock()
+
+        if snapshot:
+            self.load_snapshot(snapshot)
+        else:
+            self.load_known_faces(progress=progress)
+
+    # -----------------------------------------------------
+    # استخراج الوجه من الصورة
+    # -----------------------------------------------------
+    def detect_faces(self, gray, min_neighbors=8, scale_factor=1.1, min_size=(30, 30)):
+        """Run the Haar cascade on a grayscale image"""
+        try:
+            cascade = self._cascades.get_nowait()
+        except queue.Empty:
+            cascade = cv2.CascadeClassifier(self.cascade_path)
+
+        try:
+            with metrics.stage("detect"):
+                return cascade.detectMultiScale(
+                    gray,
+                    scaleFactor=scale_factor,
+                    minNeighbors=min_neighbors,
+                    minSize=min_size
+                )
+        finally:
+            self._cascades.put(cascade)
+
+    def detect_faces_in_frame(self, gray):
+        """Detect faces in a video frame using the configured detection mode
+
+        Boxes are always returned in full-resolution coordinates.
+        """
+        scale = self.detection_scale
+        if scale >= 1.0:
+            return self.detect_faces(gray, scale_factor=self.scale_factor,
+                                     min_size=self.min_size)
+
+        # The downscaled copy is written into a per-thread buffer that is
+        # reused as long as the frame size does not change
+        height, width = gray.shape[:2]
+        small_size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        small = getattr(self._thread_local, "small", None)
+        if small is None or small.shape != (small_size[1], small_size[0]):
+            small = np.empty((small_size[1], small_size[0]), dtype=np.uint8)
+            self._thread_local.small = small
+        cv2.resize(gray, None, dst=small, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        min_size = (max(1, int(round(self.min_size[0] * scale))),
+                    max(1, int(round(self.min_size[1] * scale))))
+        faces = self.detect_faces(small, scale_factor=self.scale_factor, min_size=min_size)
+        if len(faces) == 0:
+            return faces
+
+        boxes = np.round(np.asarray(faces, dtype=np.float32) / scale).astype(np.int32)
+        boxes[:, 0] = np.clip(boxes[:, 0], 0, width - 1)
+        boxes[:, 1] = np.clip(boxes[:, 1], 0, height - 1)
+        boxes[:, 2] = np.minimum(boxes[:, 2], width - boxes[:, 0])
+        boxes[:, 3] = np.minimum(boxes[:, 3], height - boxes[:, 1])
+        return boxes
+
+    def read_image(self, image_path):
+        """Read an image from disk (supports non-ASCII paths)"""
+        with open(image_path, 'rb') as f:
+            return self.decode_image(f.read())
+
+    @staticmethod
+    def decode_image(image_bytes):
+        """Decode an encoded image (JPEG, PNG...) held in memory, or None"""
+        buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+        if buffer.size == 0:
+            return None
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+    def extract_face_from_path(self, name, photo_path):
+        """Return the normalized face crop of a stored photo, or None"""
+        try:
+            image = self.read_image(photo_path)
+            if image is None:
+                print(f"✗ فشل فتح الصورة: {photo_path}")
+                return None
+
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            faces_detected = self.detect_faces(gray, min_neighbors=5)
+
+            if len(faces_detected) == 0:
+                print(f"✗ لا يوجد وجه في الصورة: {name}")
+                return None
+
+            return crop_face(gray, faces_detected[0])
+
+        except Exception as e:
+            print(f"✗ خطأ في تحميل {name}: {str(e)}")
+            return None
+
+    # -----------------------------------------------------
+    # قوالب الوجوه في قاعدة البيانات
+    # -----------------------------------------------------
+    @staticmethod
+    def _photo_signature(photo_path):
+        """(mtime_ns, size) of a photo, or None if it is missing"""
+        try:
+            stat = os.stat(photo_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def face_template_row(self, person_id, photo_path, face, min_neighbors=5):
+        """Database row storing a face crop keyed by its photo mtime/size
+
+        With ``face`` None the row records that the photo has no usable face.
+        """
+        mtime_ns, size = self._photo_signature(photo_path) or (None, None)
+        detector = json.dumps({
+            "cascade": os.path.basename(self.cascade_path),
+            "min_neighbors": min_neighbors,
+            "face_size": list(FACE_SIZE),
+        })
+        if face is None:
+            return (person_id, CACHE_VERSION, detector, mtime_ns, size, None, None, None)
+        face = np.ascontiguousarray(face, dtype=np.uint8)
+        return (person_id, CACHE_VERSION, detector, mtime_ns, size,
+                face.shape[1], face.shape[0], face.tobytes())
+
+    def save_face_templates(self, rows):
+        try:
+            self.db.save_face_templates(rows)
+        except Exception as e:
+            print(f"تحذير: فشل حفظ قوالب الوجوه: {str(e)}")
+
+    def save_model(self):
+        """Write the gallery histograms to the cache directory"""
+        # Unique per writer: the bridge and the camera process both save
+        # the gallery when they start
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                        prefix=os.path.basename(self.model_path) + ".",
+                                        suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.recognizer.save(f)
+            os.replace(tmp_path, self.model_path)
+        except Exception as e:
+            print(f"تحذير: فشل حفظ النموذج: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _train(self, faces, labels, changed_ids, progress=None):
+        """Build the gallery, reusing the cached histograms where possible"""
+        matcher = GalleryMatcher()
+        if os.path.exists(self.model_path):
+            try:
+                matcher.load(self.model_path)
+            except Exception:
+                matcher.clear()
+        matcher.reserve(len(labels))
+
+        # Drop people that were removed or whose photo changed, then add
+        # the histograms the cached gallery is missing
+        stale = (set(matcher.labels.tolist()) - set(labels)) | changed_ids
+        changed = matcher.remove(stale) > 0
+
+        present = set(matcher.labels.tolist())
+        new_faces = [f for f, l in zip(faces, labels) if l not in present]
+        new_labels = [l for l in labels if l not in present]
+        if new_faces:
+            # Added in steps so a cold start can report its progress
+            for start in range(0, len(new_faces), PROGRESS_STEP):
+                end = start + PROGRESS_STEP
+                matcher.add_faces(new_labels[start:end], new_faces[start:end])
+                if progress is not None:
+                    progress("train", min(end, len(new_faces)), len(new_faces))
+            changed = True
+
+        self.recognizer = matcher
+        if changed:
+            self.save_model()
+
+        if self.ann_probes:
+            matcher.set_index(IVFIndex(n_lists=self.ann_lists, n_probe=self.ann_probes))
 
     # -----------------------------------------------------
     # تحميل الصور وتدريب النظام
     # -----------------------------------------------------
-    def load_known_faces(self):
-        """Load all known faces from database and train the recognizer"""
+    def load_known_faces(self, use_cache=True, workers=None, progress=None):
+        """Load all known faces from database and train the recognizer
+
+        Face crops come from the templates stored in the database and the
+        gallery histograms are cached under ``cache_dir``; only photos that
+        are new or changed since the last run are decoded and run through
+        the detector again, spread over ``workers`` threads. The result does
+        not depend on the number of workers.
+
+        ``progress(stage, done, total)`` is called every few hundred people
+        while stored crops are read ("load"), photos are decoded
+        ("extract") and histograms are computed ("train").
+        """
+        with self.lock:
+            self._load_known_faces(use_cache, workers or self.workers, progress)
+
+    def _extract_faces(self, people, workers, progress=None):
+        """Extract the crops of ``people`` in order, using a thread pool"""
+        def extract(person):
+            return self.extract_face_from_path(person[1], person[2])
+
+        if workers <= 1 or len(people) <= 1:
+            return list(_with_progress(map(extract, people), progress, "extract", len(people)))
+
+        # OpenCV releases the GIL while decoding and detecting, so threads
+        # scale across cores; map() keeps the results in input order
+        with ThreadPoolExecutor(max_workers=min(workers, len(people))) as pool:
+            return list(_with_progress(pool.map(extract, people), progress, "extract", len(people)))
+
+    def _load_known_faces(self, use_cache, workers, progress=None):
         self.known_face_ids = []
         self.known_face_names = {}
+        self.face_templates = {}
+
+        # One sequential query returns every person with their stored crop
+        people = []
+        cached = {}
+        upgraded = set()
+        total = sum(self.db.count_face_templates().values()) if progress is not None else 0
+        for row in _with_progress(self.db.iter_gallery(), progress, "load", total):
+            person_id, name, photo_path, version, mtime_ns, size, width, height, blob = row
+            signature = self._photo_signature(photo_path)
+
+            # A stored crop is used even when the photo is gone; when the
+            # photo is present it must not have changed since extraction
+            face = None
+            if use_cache and (signature is None or signature == (mtime_ns, size)):
+                face = template_face(version, width, height, blob)
 
-        people = self.db.get_all_people()
+                # No face was found in this very photo last time
+                if blob is None and version == CACHE_VERSION:
+                    continue
+
+            if face is not None:
+                cached[person_id] = face
+                if version != CACHE_VERSION:
+                    upgraded.add(person_id)
+            elif signature is None:
+                continue
+
+            people.append((person_id, name, photo_path))
 
         if not people:
             print("لا توجد وجوه مسجلة")
+            # Otherwise later enrollments would join the old columns
+            self.recognizer = GalleryMatcher()
             self.is_trained = False
             return
 
+        missing = [person for person in people if person[0] not in cached]
+        extracted = dict(zip(
+            [person[0] for person in missing],
+            self._extract_faces(missing, workers, progress) if missing else []
+        ))
+
         faces = []
         labels = []
+        changed_ids = set()
 
-        for person in people:
-            person_id, name, photo_path, created_at = person
-
-            if os.path.exists(photo_path):
-                try:
-                    with open(photo_path, 'rb') as f:
-                        file_bytes = np.asarray(bytearray(f.read()), dtype=np.uint8)
-
-                    image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-                    if image is None:
-                        print(f"✗ فشل فتح الصورة: {photo_path}")
-                        continue
-
-                    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        new_templates = []
 
-                    faces_detected = self.face_cascade.detectMultiScale(
-                        gray,
-                        scaleFactor=1.1,
-                        minNeighbors=5,
-                        minSize=(30, 30)
-                    )
+        for person_id, name, photo_path in people:
+            face = cached.get(person_id)
+            if person_id in upgraded:
+                new_templates.append(self.face_template_row(person_id, photo_path, face))
+                changed_ids.add(person_id)
+            elif face is None:
+                face = extracted[person_id]
+                if face is None:
+                    # Recorded so the photo is not decoded again until it changes
+                    new_templates.append(self.face_template_row(person_id, photo_path, None))
+                    continue
+                new_templates.append(self.face_template_row(person_id, photo_path, face))
+                changed_ids.add(person_id)
+                print(f"✓ تم تحميل وجه: {name}")
 
-                    if len(faces_detected) > 0:
-                        (x, y, w, h) = faces_detected[0]
-                        face_roi = gray[y:y + h, x:x + w]
-                        face_roi = cv2.resize(face_roi, (200, 200))
+            faces.append(face)
+            labels.append(person_id)
+            self.known_face_ids.append(person_id)
+            self.known_face_names[person_id] = name
+            self.face_templates[person_id] = face
 
-                        faces.append(face_roi)
-                        labels.append(person_id)
-                        self.known_face_names[person_id] = name
-
-                        print(f"✓ تم تحميل وجه: {name}")
-                    else:
-                        print(f"✗ لا يوجد وجه في الصورة: {name}")
-
-                except Exception as e:
-                    print(f"✗ خطأ في تحميل {name}: {str(e)}")
+        self.save_face_templates(new_templates)
+        if cached:
+            print(f"✓ تم تحميل {len(cached)} وجه من قاعدة البيانات")
 
         if faces:
-            self.recognizer.train(faces, np.array(labels))
+            if not use_cache and os.path.exists(self.model_path):
+                os.remove(self.model_path)
+            self._train(faces, labels, changed_ids, progress)
             self.is_trained = True
             print("\n" + "=" * 60)
             print(f"✓ تم تدريب النظام على {len(faces)} وجه")
             print("=" * 60 + "\n")
         else:
+            self.recognizer = GalleryMatcher()
             self.is_trained = False
             print("\n⚠ لا توجد وجوه صالحة للتدريب")
 
+    def rebuild(self):
+        """Re-extract every face from its photo and retrain from scratch"""
+        self.load_known_faces(use_cache=False)
+
+    def enroll_face(self, person_id, name, face):
+        """Add a single face crop to the trained model without retraining
+
+        The cached model on disk is left untouched; the next
+        ``load_known_faces`` picks the new crop up from its stored template
+        and extends the model with it.
+        """
+        with self.lock:
+            self.recognizer.add_faces([person_id], [face])
+            self.is_trained = True
+
+            self.known_face_ids.append(person_id)
+            self.known_face_names[person_id] = name
+            self.face_templates[person_id] = face
+
+    def save_snapshot(self, directory):
+        """Write a read-only copy of the gallery for other processes"""
+        with self.lock:
+            self.recognizer.save_snapshot(directory)
+            with open(os.path.join(directory, "names.json"), 'w', encoding='utf-8') as f:
+                json.dump({str(k): v for k, v in self.known_face_names.items()}, f,
+                          ensure_ascii=False)
+
+    def load_snapshot(self, directory):
+        """Use a gallery written by ``save_snapshot`` (memory-mapped)"""
+        matcher = GalleryMatcher.open_snapshot(directory)
+        with open(os.path.join(directory, "names.json"), encoding='utf-8') as f:
+            names = {int(k): v for k, v in json.load(f).items()}
+
+        if self.ann_probes:
+            matcher.set_index(IVFIndex(n_lists=self.ann_lists, n_probe=self.ann_probes))
+
+        with self.lock:
+            self.recognizer = matcher
+            self.known_face_names = names
+            self.known_face_ids = list(names)
+            self.face_templates = {}
+            self.is_trained = len(matcher) > 0
+
+    def match_faces(self, faces, k=1):
+        """Score 200x200 face crops against the whole gallery in one batch
+
+        Returns ``(labels, distances)`` arrays of shape (len(faces), k).
+        """
+        with self.lock:
+            return self.recognizer.search_faces(faces, k)
+
     # -----------------------------------------------------
     # كتابة نص عربي على الفيديو باستخدام PIL
     # -----------------------------------------------------
-    def draw_arabic_text(self, frame, text, position, color):
-        try:
-            frame_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            draw = ImageDraw.Draw(frame_pil)
-
+    def _get_font(self, font_size):
+        font = self._fonts.get(font_size)
+        if font is None:
+            # PIL and the Arabic shaping modules are only needed for labels,
+            # so headless users (bridge, scanners) never import them
+            from PIL import ImageFont
             try:
-                font = ImageFont.truetype("arial.ttf", 24)
-            except:
+                font = ImageFont.truetype("arial.ttf", font_size)
+            except Exception:
                 font = ImageFont.load_default()
+            self._fonts[font_size] = font
+        return font
 
-            reshaped_text = arabic_reshaper.reshape(text)
-            bidi_text = get_display(reshaped_text)
+    def _render_label(self, text, color, font_size):
+        """Render a label (white text on a ``color`` box) to a BGR sprite"""
+        from PIL import Image, ImageDraw
+        import arabic_reshaper
+        from bidi.algorithm import get_display
 
-            bbox = draw.textbbox((0, 0), bidi_text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
+        font = self._get_font(font_size)
+        bidi_text = get_display(arabic_reshaper.reshape(text))
 
-            x, y = position
-            bg_color = tuple(reversed(color))
+        bbox = ImageDraw.Draw(Image.new("RGB", (1, 1))).textbbox((0, 0), bidi_text, font=font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
 
-            draw.rectangle(
-                [(x, y), (x + text_width + 12, y + text_height + 12)],
-                fill=bg_color
-            )
+        bg_color = tuple(reversed(color))
+        sprite = Image.new("RGB", (text_width + 13, text_height + 13), bg_color)
+        ImageDraw.Draw(sprite).text((6, 6), bidi_text, font=font, fill=(255, 255, 255))
+
+        return np.ascontiguousarray(np.asarray(sprite)[:, :, ::-1])
+
+    def get_label_sprite(self, text, color, font_size=LABEL_FONT_SIZE):
+        """Cached BGR sprite of a label, keyed by (text, color, font size)"""
+        key = (text, tuple(color), font_size)
+        with self._label_lock:
+            sprite = self._label_cache.get(key)
+            if sprite is not None:
+                self._label_cache.move_to_end(key)
+                return sprite
 
-            draw.text((x + 6, y + 6), bidi_text, font=font, fill=(255, 255, 255))
+        sprite = self._render_label(text, color, font_size)
 
-            frame = cv2.cvtColor(np.array(frame_pil), cv2.COLOR_RGB2BGR)
+        with self._label_lock:
+            self._label_cache[key] = sprite
+            while len(self._label_cache) > LABEL_CACHE_SIZE:
+                self._label_cache.popitem(last=False)
+        return sprite
+
+    def draw_arabic_text(self, frame, text, position, color, font_size=LABEL_FONT_SIZE):
+        """Paste a cached label sprite into the frame in place
+
+        The label is an opaque box, so pasting it into the ROI is the same
+        as alpha blending with a full alpha; parts outside the frame are
+        clipped.
+        """
+        try:
+            sprite = self.get_label_sprite(text, color, font_size)
+
+            x, y = position
+            height, width = frame.shape[:2]
+            x0, y0 = max(x, 0), max(y, 0)
+            x1 = min(x + sprite.shape[1], width)
+            y1 = min(y + sprite.shape[0], height)
+            if x0 < x1 and y0 < y1:
+                frame[y0:y1, x0:x1] = sprite[y0 - y:y1 - y, x0 - x:x1 - x]
             return frame
 
         except Exception:
@@ -136,91 +643,483 @@ class FaceRecognizer:
     # -----------------------------------------------------
     # التعرف على الوجوه
     # -----------------------------------------------------
-    def recognize_faces_in_frame(self, frame):
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    def _search_crops(self, face_rois):
+        """Closest gallery person of each face crop, scored in one batch
+
+        Returns ``(labels, distances, names)`` or None when the gallery is
+        empty.
+        """
+        if len(face_rois) == 0:
+            return None
+
+        with self.lock:
+            if not self.is_trained:
+                return None
+            try:
+                with metrics.stage("predict"):
+                    labels, distances = self.recognizer.search_faces(face_rois)
+                return labels[:, 0], distances[:, 0], dict(self.known_face_names)
+            except Exception as e:
+                print(f"خطأ في التعرف: {str(e)}")
+                return None
+
+    def match_boxes(self, gray, faces, verbose=True):
+        """(person_id, name, confidence) for each (x, y, w, h) box of a gray frame
+
+        ``person_id`` is None for faces that match nobody in the gallery.
+        """
+        results = [(None, "غير معروف", 0)] * len(faces)
 
-        faces = self.face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=8,
-            minSize=(30, 30)
-        )
+        face_rois = [crop_face(gray, box) for box in faces]
+        found = self._search_crops(face_rois)
+        if found is None:
+            return results
 
-        for (x, y, w, h) in faces:
-            face_roi = gray[y:y + h, x:x + w]
-            face_roi = cv2.resize(face_roi, (200, 200))
+        labels, distances, names = found
+        for i in range(len(faces)):
+            label, conf = int(labels[i]), float(distances[i])
 
-            name = "غير معروف"
-            confidence = 0
+            if conf < MATCH_DISTANCE and label in names:
+                name = names[label]
+                results[i] = (label, name, MATCH_DISTANCE - conf)
+                if verbose:
+                    print(f"✓ تم التعرف على: {name} (ثقة: {conf:.1f})")
 
-            if self.is_trained:
-                try:
-                    label, conf = self.recognizer.predict(face_roi)
+        return results
 
-                    if conf < 100:
-                        name = self.known_face_names.get(label, "غير معروف")
-                        confidence = 100 - conf
-                        print(f"✓ تم التعرف على: {name} (ثقة: {conf:.1f})")
+    def recognize(self, image):
+        """Find and identify every face of an image without drawing anything
 
-                except Exception as e:
-                    print(f"خطأ في التعرف: {str(e)}")
+        ``image`` is a BGR or grayscale array, or the bytes of an encoded
+        image. Returns a list of Match in detection order, or None when the
+        bytes cannot be decoded.
+        """
+        return self.recognize_batch([image], workers=1)[0]
 
-            color = (0, 255, 0) if name != "غير معروف" else (0, 0, 255)
-            cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+    def recognize_batch(self, images, workers=None):
+        """``recognize`` for many images; returns one result per image
 
-            frame = self.draw_arabic_text(frame, name, (x, y - 40), color)
+        Images are decoded and their faces detected on ``workers`` threads
+        (OpenCV releases the GIL); the crops of all images are then scored
+        against the gallery in a single batch.
+        """
+        def detect(image):
+            if isinstance(image, (bytes, bytearray, memoryview)):
+                image = self.decode_image(image)
+                if image is None:
+                    return None
+            gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            return [(box, crop_face(gray, box)) for box in self.detect_faces_in_frame(gray)]
+
+        workers = min(workers or self.workers, len(images))
+        if workers <= 1:
+            detected = [detect(image) for image in images]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                detected = list(pool.map(detect, images))
+
+        found = self._search_crops([crop for faces in detected if faces for _, crop in faces])
+
+        results = []
+        index = 0
+        for faces in detected:
+            if faces is None:
+                results.append(None)
+                continue
+            matches = []
+            for box, _ in faces:
+                match = Match(box)
+                if found is not None:
+                    labels, distances, names = found
+                    label, distance = int(labels[index]), float(distances[index])
+                    match.distance = distance
+                    if distance < MATCH_DISTANCE and label in names:
+                        match.person_id, match.name = label, names[label]
+                index += 1
+                matches.append(match)
+            results.append(matches)
+
+        return results
+
+    def identify_faces(self, gray, faces):
+        """Name and confidence for each (x, y, w, h) box of a gray frame"""
+        return [(name, confidence) for _, name, confidence in self.match_boxes(gray, faces)]
+
+    def annotate_frame(self, frame, faces, names):
+        """Draw the box and Arabic name of every face on the frame"""
+        with metrics.stage("annotate"):
+            for (x, y, w, h), name in zip(faces, names):
+                color = (0, 255, 0) if name != "غير معروف" else (0, 0, 255)
+                cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+
+                frame = self.draw_arabic_text(frame, name, (x, y - 40), color)
 
         return frame
 
+    def recognize_faces_in_frame(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        faces = self.detect_faces_in_frame(gray)
+        if len(faces) == 0:
+            return frame
+
+        results = self.identify_faces(gray, faces)
+        return self.annotate_frame(frame, faces, [name for name, _ in results])
+
     # -----------------------------------------------------
     # إضافة شخص جديد
     # -----------------------------------------------------
     def add_person_from_image(self, name, image_path):
+        """Enroll a person from an image file, storing a copy in data/photos
+
+        Returns ``(success, message, person_id)`` like ``add_person_from_bytes``.
+        """
         try:
             if not os.path.exists(image_path):
-                return False, "الملف غير موجود"
+                return False, "الملف غير موجود", None
 
             with open(image_path, 'rb') as f:
-                file_bytes = np.asarray(bytearray(f.read()), dtype=np.uint8)
+                image_bytes = f.read()
+
+        except Exception as e:
+            return False, f"خطأ: {str(e)}", None
+
+        return self.add_person_from_bytes(name, image_bytes)
+
+    def find_duplicate(self, content_hash, image_hash=None, face_hash=None):
+        """(person_id, name) of an enrolled photo matching these hashes, or None
 
-            image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+        The same bytes always match; otherwise both the image and the face
+        crop hashes must be close. Faces alone are too alike to tell a
+        resubmitted photo from another photo of someone else.
+        """
+        for person_id, name, content, image, face in self.db.find_photo_hashes(content_hash,
+                                                                              image_hash):
+            if content == content_hash:
+                return person_id, name
+            if (image_hash is not None and face_hash is not None
+                    and hamming(image, image_hash) <= DUPLICATE_IMAGE_BITS
+                    and hamming(face, face_hash) <= DUPLICATE_FACE_BITS):
+                return person_id, name
+        return None
+
+    def is_photo_of(self, person_id, photo_path):
+        """Whether ``photo_path`` is the stored photo of ``person_id``"""
+        person = self.db.get_person_by_id(person_id)
+        if person is None:
+            return False
+        return os.path.abspath(person[2]) == os.path.abspath(photo_path)
+
+    def add_person_from_bytes(self, name, image_bytes, photo_path=None):
+        """Enroll a person from an encoded image held in memory
+
+        The image is decoded straight from the buffer. It is written to
+        data/photos only once the face checks pass, unless ``photo_path``
+        says where it is already stored (e.g. streamed there by an upload):
+        that file becomes the person's photo, and is removed when the image
+        is rejected or duplicates an enrolled photo - unless it already is
+        that person's photo, as when a queued report is processed again.
+
+        A photo that is already enrolled (same bytes, or the same picture
+        resized/recompressed) is not added again; the existing person is
+        reported instead.
+
+        Returns ``(success, message, person_id)``: the id of the new person,
+        or of the enrolled one for a duplicate; None on failure.
+        """
+        adopted = False
+        try:
+            # Exact resubmissions are caught before decoding anything
+            content_hash = hashlib.sha256(image_bytes).hexdigest()
+            duplicate = self.find_duplicate(content_hash)
+            if duplicate is not None:
+                adopted = photo_path is not None and self.is_photo_of(duplicate[0], photo_path)
+                return True, f"الصورة مسجلة مسبقاً باسم {duplicate[1]}", duplicate[0]
+
+            image = self.decode_image(image_bytes)
 
             if image is None:
-                return False, "فشل قراءة الصورة"
+                return False, "فشل قراءة الصورة", None
 
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-            faces = self.face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,
-                minNeighbors=8,
-                minSize=(30, 30)
-            )
+            faces = self.detect_faces(gray)
 
             if len(faces) == 0:
-                return False, "لم يتم العثور على وجه"
+                return False, "لم يتم العثور على وجه", None
 
             if len(faces) > 1:
-                return False, "الصورة تحتوي على أكثر من وجه"
+                return False, "الصورة تحتوي على أكثر من وجه", None
 
-            unique_id = str(uuid.uuid4())[:8] + ".jpg"
-            save_path = os.path.join("data/photos", unique_id)
+            face = crop_face(gray, faces[0])
+            image_hash, face_hash = dhash(gray), dhash(face)
 
-            shutil.copy(image_path, save_path)
+            # Checked again under the lock so two concurrent submissions of
+            # the same photo cannot both be enrolled
+            with self.lock:
+                duplicate = self.find_duplicate(content_hash, image_hash, face_hash)
+                if duplicate is not None:
+                    adopted = photo_path is not None and self.is_photo_of(duplicate[0], photo_path)
+                    return True, f"الصورة مسجلة مسبقاً باسم {duplicate[1]}", duplicate[0]
 
-            person_id = self.db.add_person(name, save_path)
+                if photo_path is None:
+                    photo_path = new_photo_path()
+                    with open(photo_path, 'wb') as f:
+                        f.write(image_bytes)
 
-            self.load_known_faces()
-            return True, f"تم إضافة {name} بنجاح"
+                # Person, hashes and template are committed together; the
+                # gallery is only extended once they are
+                with metrics.stage("enroll_db"):
+                    template = self.face_template_row(None, photo_path, face, min_neighbors=8)
+                    person_id = self.db.enroll_person(name, photo_path,
+                                                      (content_hash, image_hash, face_hash),
+                                                      template[1:])
+                    adopted = True
+                self.enroll_face(person_id, name, face)
+
+            return True, f"تم إضافة {name} بنجاح", person_id
 
         except Exception as e:
-            return False, f"خطأ: {str(e)}"
+            return False, f"خطأ: {str(e)}", None
+
+        finally:
+            if not adopted and photo_path is not None and os.path.exists(photo_path):
+                os.remove(photo_path)
 
     # -----------------------------------------------------
     # حذف شخص
     # -----------------------------------------------------
     def delete_person(self, person_id):
-        success = self.db.delete_person(person_id)
-        if success:
-            self.load_known_faces()
-        return success
+        return self.delete_people([person_id]) == 1
+
+    def delete_people(self, person_ids):
+        """Delete several people, dropping their rows from the gallery
+
+        No retraining is involved. Returns the number of people that were
+        actually deleted.
+        """
+        with self.lock:
+            # Their face templates go with them (ON DELETE CASCADE)
+            deleted = self.db.delete_people(person_ids)
+            self.forget_people(deleted)
+
+        if deleted:
+            # The resident camera process drops them too (no-op when it is
+            # not running, or when this is that process)
+            from recognition_service import send_command
+            send_command('person_removed', person_ids=deleted)
+
+        return len(deleted)
+
+    # -----------------------------------------------------
+    # مزامنة المعرض مع قاعدة البيانات
+    # -----------------------------------------------------
+    def forget_people(self, person_ids):
+        """Drop people from the in-memory gallery only; returns the count"""
+        in_model = []
+
+        with self.lock:
+            for person_id in person_ids:
+                self.known_face_names.pop(person_id, None)
+                if self.face_templates.pop(person_id, None) is not None:
+                    self.known_face_ids.remove(person_id)
+                    in_model.append(person_id)
+
+            if in_model:
+                self.recognizer.remove(in_model)
+                self.is_trained = len(self.recognizer) > 0
+
+        return len(in_model)
+
+    def add_known_people(self, person_ids):
+        """Enroll people added to the database by another process
+
+        Uses their stored face templates, so no photo is decoded. Returns
+        the number of people added to the gallery.
+        """
+        added = 0
+        rows = self.db.get_face_templates(person_ids)
+
+        with self.lock:
+            for person_id, name, version, width, height, blob in rows:
+                face = template_face(version, width, height, blob)
+                if person_id in self.face_templates or face is None:
+                    continue
+                self.enroll_face(person_id, name, face)
+                added += 1
+
+        return added
+
+    def sync_known_faces(self):
+        """Apply additions and removals made by other processes in place
+
+        Only the ids are compared with the database and only the templates
+        of new people are read. Returns ``(added, removed)``.
+        """
+        person_ids = set(self.db.get_person_ids())
+        with self.lock:
+            known = set(self.face_templates)
+            removed = self.forget_people(known - person_ids)
+        added = self.add_known_people(person_ids - known)
+        return added, removed
+
+
+# -----------------------------------------------------
+# تتبع الوجوه بين الإطارات
+# -----------------------------------------------------
+def box_iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+class FaceTrack:
+    """A face followed across frames together with its cached identity"""
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.name = "غير معروف"
+        self.confidence = 0
+        self.identified = False
+        self.frames_since_id = 0
+        self.missed = 0
+
+
+class FaceTracker:
+    """Run detection every few frames and follow faces in between
+
+    Between detections boxes are moved with sparse Lucas-Kanade optical
+    flow; on detection frames they are matched to the new detections by
+    IoU. A track keeps its recognized name and is only re-identified every
+    ``reidentify_every`` frames, or at the next detection while its
+    confidence stays below ``min_confidence`` (unknown faces included).
+    """
+
+    def __init__(self, recognizer, detect_every=5, reidentify_every=30,
+                 min_confidence=20, iou_threshold=0.3, max_missed=2):
+        self.recognizer = recognizer
+        self.detect_every = max(1, detect_every)
+        self.reidentify_every = reidentify_every
+        self.min_confidence = min_confidence
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+
+        self.tracks = []
+        self.frame_index = 0
+        self.prev_gray = None
+        self._next_id = 1
+
+        # process() alternates between two gray buffers so the previous
+        # frame survives for optical flow without a new array per frame
+        self._spare_gray = None
+
+    def reset(self):
+        self.tracks = []
+        self.frame_index = 0
+        self.prev_gray = None
+
+    def _flow_boxes(self, gray):
+        """Shift every track by the median optical flow inside its box"""
+        height, width = gray.shape[:2]
+        for track in self.tracks:
+            x, y, w, h = track.box
+            points = cv2.goodFeaturesToTrack(self.prev_gray[y:y + h, x:x + w], maxCorners=30,
+                                             qualityLevel=0.01, minDistance=5)
+            if points is None:
+                continue
+
+            points += np.array([x, y], dtype=np.float32)
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None)
+            good = status.reshape(-1) == 1
+            if not good.any():
+                continue
+
+            dx, dy = np.median((moved - points).reshape(-1, 2)[good], axis=0)
+            x = int(np.clip(round(x + dx), 0, width - w))
+            y = int(np.clip(round(y + dy), 0, height - h))
+            track.box = (x, y, w, h)
+
+    def _match_detections(self, faces):
+        """Update tracks from fresh detections; returns the new tracks"""
+        unmatched = list(range(len(faces)))
+        new_tracks = []
+
+        for track in self.tracks:
+            best, best_iou = None, self.iou_threshold
+            for i in unmatched:
+                iou = box_iou(track.box, faces[i])
+                if iou >= best_iou:
+                    best, best_iou = i, iou
+
+            if best is None:
+                track.missed += 1
+            else:
+                track.box = tuple(int(v) for v in faces[best])
+                track.missed = 0
+                unmatched.remove(best)
+
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+
+        for i in unmatched:
+            track = FaceTrack(self._next_id, tuple(int(v) for v in faces[i]))
+            self._next_id += 1
+            self.tracks.append(track)
+            new_tracks.append(track)
+
+        return new_tracks
+
+    def update(self, gray):
+        """Advance the tracker by one gray frame; returns the live tracks"""
+        detect = self.frame_index % self.detect_every == 0 or self.prev_gray is None
+
+        if detect:
+            faces = self.recognizer.detect_faces_in_frame(gray)
+            self._match_detections(list(faces))
+        elif self.tracks:
+            with metrics.stage("track"):
+                self._flow_boxes(gray)
+
+        for track in self.tracks:
+            track.frames_since_id += 1
+
+        # Identify new tracks, stale identities and (on detection frames)
+        # tracks whose identity is still uncertain
+        pending = [
+            t for t in self.tracks
+            if t.missed == 0 and (
+                not t.identified
+                or t.frames_since_id >= self.reidentify_every
+                or (detect and t.confidence < self.min_confidence)
+            )
+        ]
+        if pending:
+            results = self.recognizer.identify_faces(gray, [t.box for t in pending])
+            for track, (name, confidence) in zip(pending, results):
+                track.name, track.confidence = name, confidence
+                track.identified = True
+                track.frames_since_id = 0
+
+        self.prev_gray = gray
+        self.frame_index += 1
+        # Tracks missed by the last detection are still shown until they
+        # expire, which keeps labels from blinking on a single miss
+        return list(self.tracks)
+
+    def process(self, frame):
+        """Track and annotate a BGR frame (drop-in for recognize_faces_in_frame)"""
+        buffer = self._spare_gray
+        if buffer is None or buffer.shape != frame.shape[:2]:
+            buffer = np.empty(frame.shape[:2], dtype=np.uint8)
+
+        previous = self.prev_gray
+        tracks = self.update(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffer))
+        self._spare_gray = previous
+        return self.recognizer.annotate_frame(frame, [t.box for t in tracks],
+                                              [t.name for t in tracks])
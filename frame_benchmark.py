@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+قياس استهلاك الذاكرة في مسار معالجة الإطارات
+Allocation benchmark of the live camera frame path (headless)
+
+    python frame_benchmark.py entrance.mp4 --frames 300
+    python frame_benchmark.py --synthetic 1280x720
+
+Runs the capture -> track/annotate -> display conversion path of
+camera_recognition.py on a video file (or synthetic frames) twice: with
+the pooled buffers the app uses and with a fresh array at every step as
+before. For each frame it reports the peak of memory allocated while the
+frame was processed (tracemalloc, which also sees NumPy buffers) and the
+growth of live memory over the run.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Frames excluded from the statistics while the pools fill up
+WARMUP_FRAMES = 10
+
+
+class SyntheticCamera:
+    """VideoCapture stand-in producing a moving gradient"""
+
+    def __init__(self, width, height, frames):
+        self.frames = frames
+        self.index = 0
+        ramp = np.linspace(0, 255, width, dtype=np.float32)
+        self.pattern = np.tile(ramp.astype(np.uint8), (height, 2))[:, :, np.newaxis]
+
+    def read(self, image=None):
+        if self.index >= self.frames:
+            return False, None
+        height, width = self.pattern.shape[:2]
+        if image is None or image.shape != (height, width // 2, 3):
+            image = np.empty((height, width // 2, 3), dtype=np.uint8)
+        shift = (self.index * 7) % (width // 2)
+        image[:] = self.pattern[:, shift:shift + width // 2]
+        self.index += 1
+        return True, image
+
+    def release(self):
+        pass
+
+
+def open_source(args):
+    if args.synthetic:
+        width, height = (int(v) for v in args.synthetic.lower().split("x"))
+        return SyntheticCamera(width, height, args.frames + WARMUP_FRAMES)
+    return cv2.VideoCapture(args.source)
+
+
+def run_pooled(camera, tracker, frames):
+    from camera_recognition import FramePool, display_frame, read_frame
+
+    pool = FramePool()
+    image = None
+    shape = None
+
+    def step():
+        nonlocal image, shape
+        ret, frame = read_frame(camera, pool, shape)
+        if not ret:
+            return False
+        shape = frame.shape
+        frame = tracker.process(frame)
+        rgb = display_frame(frame, pool)
+        if image is None or image.size != (rgb.shape[1], rgb.shape[0]):
+            image = Image.new("RGB", (rgb.shape[1], rgb.shape[0]))
+        image.frombytes(rgb)
+        pool.release(frame)
+        pool.release(rgb)
+        return True
+
+    return measure(step, frames)
+
+
+def run_baseline(camera, tracker, frames):
+    from camera_recognition import DISPLAY_MAX_HEIGHT, DISPLAY_MAX_WIDTH
+
+    def step():
+        ret, frame = camera.read()
+        if not ret:
+            return False
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        tracks = tracker.update(gray)
+        frame = tracker.recognizer.annotate_frame(frame, [t.box for t in tracks],
+                                                  [t.name for t in tracks])
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        height, width = frame_rgb.shape[:2]
+        scale = min(DISPLAY_MAX_WIDTH / width, DISPLAY_MAX_HEIGHT / height)
+        resized = cv2.resize(frame_rgb, (int(width * scale), int(height * scale)))
+        Image.fromarray(resized)
+        return True
+
+    return measure(step, frames)
+
+
+def measure(step, frames):
+    peaks = []
+    times = []
+    start_memory = None
+
+    tracemalloc.start()
+    try:
+        for index in range(frames):
+            if index == WARMUP_FRAMES:
+                start_memory = tracemalloc.get_traced_memory()[0]
+
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            if not step():
+                break
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] - before
+
+            if index >= WARMUP_FRAMES:
+                peaks.append(peak)
+                times.append(elapsed)
+
+        end_memory = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    if not peaks:
+        return None
+    return {
+        "frames": len(peaks),
+        "median_peak_kb": statistics.median(peaks) / 1024,
+        "max_peak_kb": max(peaks) / 1024,
+        "growth_kb": (end_memory - start_memory) / 1024,
+        "ms_per_frame": 1000 * statistics.mean(times),
+    }
+
+
+def main():
+    from face_recognizer import FaceRecognizer, FaceTracker
+
+    parser = argparse.ArgumentParser(description="Per-frame allocations of the camera frame path")
+    parser.add_argument("source", nargs="?", help="video file")
+    parser.add_argument("--synthetic", default=None, metavar="WxH",
+                        help="use generated frames of this size instead of a video")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--detect-every", type=int, default=5)
+    parser.add_argument("--detection-scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if not args.source and not args.synthetic:
+        parser.error("a video file or --synthetic WxH is required")
+
+    recognizer = FaceRecognizer(detection_scale=args.detection_scale)
+
+    for label, run in (("baseline", run_baseline), ("pooled", run_pooled)):
+        camera = open_source(args)
+        tracker = FaceTracker(recognizer, detect_every=args.detect_every)
+        stats = run(camera, tracker, args.frames + WARMUP_FRAMES)
+        camera.release()
+
+        if stats is None:
+            print(f"{label}: لا توجد إطارات كافية")
+            continue
+        print(f"{label:9s} {stats['frames']} إطار  "
+              f"ذروة/إطار: وسيط {stats['median_peak_kb']:.1f}KB، أقصى {stats['max_peak_kb']:.1f}KB  "
+              f"نمو: {stats['growth_kb']:.1f}KB  {stats['ms_per_frame']:.2f}ms/إطار")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+import os
+
+import numpy as np
+
+# Same parameters as cv2.face.LBPHFaceRecognizer_create() defaults
+RADIUS = 1
+NEIGHBORS = 8
+GRID_X = 8
+GRID_Y = 8
+NUM_PATTERNS = 2 ** NEIGHBORS
+
+# Gallery columns scored at once; bounds the temporary (bins x columns)
+# float32 arrays to a few tens of MB
+CHUNK_COLUMNS = 2048
+
+# Faces converted to LBP codes at once
+CHUNK_FACES = 64
+
+# Growing the gallery copies the whole matrix, so loading leaves room for
+# HEADROOM_COLUMNS more people and a full matrix only grows by
+# GROWTH_FACTOR (a larger factor would need ~3x the gallery while copying)
+HEADROOM_COLUMNS = 256
+GROWTH_FACTOR = 1.25
+
+
+def _neighbor_weights():
+    """Bilinear sampling offsets and weights of the circular LBP neighbours"""
+    # Computed in float32 exactly like OpenCV, otherwise rounding flips a
+    # few bits where a sample lands on the centre value
+    one = np.float32(1)
+    weights = []
+    for n in range(NEIGHBORS):
+        x = np.float32(RADIUS * np.cos(2.0 * np.pi * n / NEIGHBORS))
+        y = np.float32(-RADIUS * np.sin(2.0 * np.pi * n / NEIGHBORS))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        tx, ty = x - np.float32(fx), y - np.float32(fy)
+        weights.append((
+            fx, fy, cx, cy,
+            (one - tx) * (one - ty), tx * (one - ty),
+            (one - tx) * ty, tx * ty,
+        ))
+    return weights
+
+
+_WEIGHTS = _neighbor_weights()
+
+
+def lbp_codes(faces):
+    """Extended LBP codes of a stack of grayscale faces (N, H, W)
+
+    Mirrors OpenCV's ``elbp`` so the histograms match the ones produced by
+    LBPHFaceRecognizer bit for bit.
+    """
+    faces = np.asarray(faces, dtype=np.float32)
+    if faces.ndim == 2:
+        faces = faces[np.newaxis]
+
+    _, rows, cols = faces.shape
+    r = RADIUS
+    center = faces[:, r:rows - r, r:cols - r]
+    codes = np.zeros(center.shape, dtype=np.int32)
+    eps = np.finfo(np.float32).eps
+
+    def shifted(dy, dx):
+        return faces[:, r + dy:rows - r + dy, r + dx:cols - r + dx]
+
+    for n, (fx, fy, cx, cy, w1, w2, w3, w4) in enumerate(_WEIGHTS):
+        # Terms with an exactly zero weight cannot change the float sum
+        t = w1 * shifted(fy, fx)
+        for w, dy, dx in ((w2, fy, cx), (w3, cy, fx), (w4, cy, cx)):
+            if w:
+                t += w * shifted(dy, dx)
+        bit = (t > center) | (np.abs(t - center) < eps)
+        codes |= bit.astype(np.int32) << n
+
+    return codes
+
+
+def lbph_histograms(faces):
+    """Spatial LBP histograms of a stack of faces as a (N, D) float32 matrix"""
+    if len(faces) > CHUNK_FACES:
+        return np.vstack([lbph_histograms(faces[start:start + CHUNK_FACES])
+                          for start in range(0, len(faces), CHUNK_FACES)])
+
+    codes = lbp_codes(faces)
+    count, rows, cols = codes.shape
+    height, width = rows // GRID_Y, cols // GRID_X
+
+    # Drop the remainder rows/columns like OpenCV does, then give every
+    # (face, cell) pair its own block of NUM_PATTERNS bins
+    codes = codes[:, :height * GRID_Y, :width * GRID_X]
+    cells = codes.reshape(count, GRID_Y, height, GRID_X, width)
+    cells = cells.transpose(0, 1, 3, 2, 4).reshape(count, GRID_Y * GRID_X, -1)
+    offsets = np.arange(count * GRID_Y * GRID_X).reshape(count, -1, 1) * NUM_PATTERNS
+
+    hist = np.bincount((cells + offsets).ravel(),
+                       minlength=count * GRID_Y * GRID_X * NUM_PATTERNS)
+    hist = hist.astype(np.float32).reshape(count, -1)
+    hist /= np.float32(height * width)
+    return hist
+
+
+def chi_square_distances(queries, gallery, gallery_sums=None, columns=None):
+    """HISTCMP_CHISQR_ALT distance of every query against every gallery column
+
+    ``gallery`` holds one histogram per column (features x N). Uses
+    ``(q-g)^2/(q+g) = q + g - 4qg/(q+g)`` so only the bins where the query
+    is non-zero have to be visited; LBP histograms are mostly empty bins.
+    ``columns`` optionally restricts the scoring to a subset of columns, in
+    which case the result has ``len(columns)`` entries per query.
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, gallery.shape[0])
+    if gallery_sums is None:
+        gallery_sums = gallery.sum(axis=0)
+    if columns is not None:
+        gallery_sums = gallery_sums[columns]
+
+    width = len(gallery_sums)
+    result = np.empty((len(queries), width), dtype=np.float32)
+
+    for i, query in enumerate(queries):
+        bins = np.flatnonzero(query)
+        values = query[bins, np.newaxis]
+        base = query.sum() + gallery_sums
+
+        for start in range(0, width, CHUNK_COLUMNS):
+            if columns is None:
+                block = gallery[bins, start:start + CHUNK_COLUMNS]
+            else:
+                block = gallery[np.ix_(bins, columns[start:start + CHUNK_COLUMNS])]
+            product = block * values
+            block += values
+            product /= block
+            end = start + block.shape[1]
+            result[i, start:end] = 2.0 * (base[start:end] - 4.0 * product.sum(axis=0))
+
+    return result
+
+
+class GalleryMatcher:
+    """LBPH-compatible matcher keeping every gallery histogram in one matrix
+
+    Histograms are stored column-wise in a single float32 (features x N)
+    array so scoring a query only has to gather its non-empty bins. An
+    optional approximate index (see ann_index.IVFIndex) limits the scored
+    columns for large galleries.
+    """
+
+    def __init__(self, feature_size=GRID_X * GRID_Y * NUM_PATTERNS, index=None):
+        self.feature_size = feature_size
+        self._matrix = np.empty((feature_size, 0), dtype=np.float32)
+        self._sums = np.empty(0, dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int64)
+        self._size = 0
+        self.index = None
+        if index is not None:
+            self.set_index(index)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def histograms(self):
+        """(N, features) view of the gallery histograms"""
+        return self._matrix[:, :self._size].T
+
+    @property
+    def labels(self):
+        return self._labels[:self._size]
+
+    def clear(self):
+        self._size = 0
+        if self.index is not None:
+            self.index.build(self._matrix[:, :0])
+
+    def set_index(self, index):
+        """Attach an approximate index and build it over the current gallery"""
+        self.index = index
+        index.build(self._matrix[:, :self._size])
+
+    def _update_index(self, histograms):
+        if self.index is None:
+            return
+        # Lists drift as the gallery grows; recluster once it has doubled
+        if not self.index.is_built or self._size > 2 * self.index.built_size:
+            self.index.build(self._matrix[:, :self._size])
+        else:
+            self.index.add(histograms)
+
+    def reserve(self, size):
+        """Make room for ``size`` columns plus some headroom, so the first
+        enrollments after a load do not reallocate the gallery"""
+        if size + HEADROOM_COLUMNS > self._matrix.shape[1]:
+            self._resize(size + HEADROOM_COLUMNS)
+
+    def _reserve(self, size):
+        if size <= self._matrix.shape[1]:
+            return
+        self._resize(max(size + HEADROOM_COLUMNS,
+                         int(GROWTH_FACTOR * self._matrix.shape[1])))
+
+    def _resize(self, capacity):
+        matrix = np.empty((self.feature_size, capacity), dtype=np.float32)
+        matrix[:, :self._size] = self._matrix[:, :self._size]
+        sums = np.empty(capacity, dtype=np.float32)
+        sums[:self._size] = self._sums[:self._size]
+        labels = np.empty(capacity, dtype=np.int64)
+        labels[:self._size] = self.labels
+        self._matrix, self._sums, self._labels = matrix, sums, labels
+
+    def add(self, labels, histograms):
+        """Append histograms (one row per label) to the gallery"""
+        histograms = np.asarray(histograms, dtype=np.float32).reshape(-1, self.feature_size)
+        labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+
+        end = self._size + len(labels)
+        self._reserve(end)
+        self._matrix[:, self._size:end] = histograms.T
+        self._sums[self._size:end] = histograms.sum(axis=1)
+        self._labels[self._size:end] = labels
+        self._size = end
+        self._update_index(histograms)
+
+    def add_faces(self, labels, faces):
+        """Extract and append the histograms of 200x200 face crops"""
+        if len(faces):
+            self.add(labels, lbph_histograms(faces))
+
+    def remove(self, labels):
+        """Drop every histogram belonging to ``labels``; returns the count
+
+        The last kept columns are moved into the freed slots, so only as
+        many columns as were removed are copied (the column order of the
+        survivors changes).
+        """
+        drop = np.isin(self.labels, np.asarray(list(labels), dtype=np.int64))
+        removed = int(drop.sum())
+        if removed:
+            kept = self._size - removed
+            holes = np.flatnonzero(drop[:kept])
+            sources = np.flatnonzero(~drop[kept:]) + kept
+            self._matrix[:, holes] = self._matrix[:, sources]
+            self._sums[holes] = self._sums[sources]
+            self._labels[holes] = self._labels[sources]
+            self._size = kept
+            if self.index is not None and self.index.is_built:
+                self.index.move(sources, holes, kept)
+        return removed
+
+    def search(self, histograms, k=1):
+        """Top-k gallery matches for each query histogram
+
+        Returns ``(labels, distances)`` arrays of shape (queries, k), nearest
+        first. Slots past the gallery size are padded with -1 / inf.
+        """
+        histograms = np.asarray(histograms, dtype=np.float32).reshape(-1, self.feature_size)
+        count = len(histograms)
+        labels = np.full((count, k), -1, dtype=np.int64)
+        distances = np.full((count, k), np.inf, dtype=np.float32)
+
+        if not self._size or not count:
+            return labels, distances
+
+        if self.index is not None and self.index.is_built:
+            return self._search_index(histograms, k, labels, distances)
+
+        scores = chi_square_distances(histograms, self._matrix[:, :self._size],
+                                      self._sums[:self._size])
+        top = min(k, self._size)
+        if top == 1:
+            # argmin keeps the first of equal distances, like OpenCV
+            nearest = scores.argmin(axis=1)[:, np.newaxis]
+        elif top < self._size:
+            nearest = np.argpartition(scores, top - 1, axis=1)[:, :top]
+        else:
+            nearest = np.broadcast_to(np.arange(self._size), (count, self._size))
+        nearest_scores = np.take_along_axis(scores, nearest, axis=1)
+        order = np.argsort(nearest_scores, axis=1, kind="stable")
+
+        labels[:, :top] = self.labels[np.take_along_axis(nearest, order, axis=1)]
+        distances[:, :top] = np.take_along_axis(nearest_scores, order, axis=1)
+        return labels, distances
+
+    def _search_index(self, histograms, k, labels, distances):
+        """Exact re-ranking of the columns selected by the approximate index"""
+        gallery = self._matrix[:, :self._size]
+        sums = self._sums[:self._size]
+
+        for i, columns in enumerate(self.index.candidates(histograms)):
+            if not len(columns):
+                continue
+            scores = chi_square_distances(histograms[i], gallery, sums, columns)[0]
+            top = min(k, len(columns))
+            nearest = np.argsort(scores, kind="stable")[:top]
+            labels[i, :top] = self.labels[columns[nearest]]
+            distances[i, :top] = scores[nearest]
+
+        return labels, distances
+
+    def search_faces(self, faces, k=1):
+        """Top-k matches for a stack of 200x200 face crops"""
+        return self.search(lbph_histograms(faces), k)
+
+    def predict(self, face):
+        """Drop-in for LBPHFaceRecognizer.predict: ``(label, distance)``"""
+        labels, distances = self.search_faces([face], k=1)
+        return int(labels[0, 0]), float(distances[0, 0])
+
+    def save(self, path):
+        np.savez(path, labels=self.labels, histograms=self.histograms)
+
+    def load(self, path):
+        with np.load(path) as data:
+            self.clear()
+            labels = data["labels"]
+            self.reserve(len(labels))
+            self.add(labels, data["histograms"])
+
+    def save_snapshot(self, directory):
+        """Write the gallery in its in-memory layout as plain .npy files"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "matrix.npy"), self._matrix[:, :self._size])
+        np.save(os.path.join(directory, "sums.npy"), self._sums[:self._size])
+        np.save(os.path.join(directory, "labels.npy"), self.labels)
+
+    @classmethod
+    def open_snapshot(cls, directory):
+        """Memory-map a snapshot written by ``save_snapshot``
+
+        The arrays are opened read-only, so every process that opens the
+        same snapshot shares one copy of the gallery through the page cache.
+        """
+        matcher = cls()
+        matcher._matrix = np.load(os.path.join(directory, "matrix.npy"), mmap_mode="r")
+        matcher._sums = np.load(os.path.join(directory, "sums.npy"), mmap_mode="r")
+        matcher._labels = np.load(os.path.join(directory, "labels.npy"), mmap_mode="r")
+        matcher.feature_size = matcher._matrix.shape[0]
+        matcher._size = matcher._matrix.shape[1]
+        return matcher
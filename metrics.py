@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+قياسات الأداء
+Per-stage timings of the hot paths, kept as rolling windows
+
+    with metrics.stage("detect"):
+        faces = cascade.detectMultiScale(gray)
+
+    metrics.count("frames_dropped")
+    metrics.tick("frames_displayed")
+
+Every stage keeps its last ``WINDOW`` durations plus a running count and
+sum, so p50/p95/p99 describe recent behaviour and are only computed when
+they are read. ``tick`` records event times for a rolling rate (FPS).
+``render_prometheus`` formats snapshots for bridge.py's /metrics route.
+
+Set FACE_METRICS=0 in the environment (or call ``set_enabled(False)``) to
+switch recording off: ``stage`` then hands out a shared no-op context
+manager and the other calls return at once.
+"""
+
+import contextlib
+import os
+import threading
+import time
+from collections import deque
+
+ENABLED = os.environ.get("FACE_METRICS", "1") != "0"
+
+# Durations kept per stage for the percentiles
+WINDOW = 1024
+
+# Events kept per rate; the rate covers at most RATE_SECONDS
+RATE_WINDOW = 256
+RATE_SECONDS = 10.0
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class RollingHistogram:
+    """Last ``size`` samples in a ring buffer plus the all-time count/sum"""
+
+    def __init__(self, size=WINDOW):
+        self._samples = [0.0] * size
+        self._next = 0
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._samples[self._next] = value
+            self._next = (self._next + 1) % len(self._samples)
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            window = sorted(self._samples[:min(self.count, len(self._samples))])
+            count, total = self.count, self.sum
+
+        # Nearest-rank quantiles, sorted only when read
+        quantiles = {}
+        if window:
+            quantiles = {str(q): window[min(len(window) - 1, int(q * len(window)))]
+                         for q in QUANTILES}
+        return {"count": count, "sum": total, "quantiles": quantiles}
+
+
+class Rate:
+    """Events per second over the recent past"""
+
+    def __init__(self, size=RATE_WINDOW):
+        self._times = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def tick(self):
+        with self._lock:
+            self._times.append(time.perf_counter())
+
+    def per_second(self):
+        now = time.perf_counter()
+        with self._lock:
+            times = [t for t in self._times if now - t <= RATE_SECONDS]
+        if len(times) < 2:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+
+class _Stage:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Registry:
+    """Named histograms, counters and rates of one process"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.rates = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, RollingHistogram())
+        return histogram
+
+    def rate(self, name):
+        rate = self.rates.get(name)
+        if rate is None:
+            with self._lock:
+                rate = self.rates.setdefault(name, Rate())
+        return rate
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """Plain dict of every metric (picklable, for IPC)"""
+        return {
+            "stages": {name: h.snapshot() for name, h in list(self.histograms.items())},
+            "counters": dict(self.counters),
+            "rates": {name: r.per_second() for name, r in list(self.rates.items())},
+        }
+
+
+REGISTRY = Registry()
+
+
+def set_enabled(enabled):
+    global ENABLED
+    ENABLED = bool(enabled)
+
+
+def stage(name):
+    """Context manager timing one run of the stage ``name``"""
+    if not ENABLED:
+        return _NULL_STAGE
+    return _Stage(REGISTRY.histogram(name))
+
+
+def observe(name, seconds):
+    if ENABLED:
+        REGISTRY.histogram(name).observe(seconds)
+
+
+def count(name, amount=1):
+    if ENABLED:
+        REGISTRY.count(name, amount)
+
+
+def tick(name):
+    if ENABLED:
+        REGISTRY.rate(name).tick()
+
+
+def snapshot():
+    return REGISTRY.snapshot()
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def render_prometheus(snapshots):
+    """Prometheus text format of ``{process: snapshot}``"""
+    lines = [
+        "# HELP face_stage_seconds Duration of each processing stage (quantiles over recent runs)",
+        "# TYPE face_stage_seconds summary",
+    ]
+    for process, snap in snapshots.items():
+        for name, stats in sorted(snap["stages"].items()):
+            for quantile, value in stats["quantiles"].items():
+                labels = _labels(process=process, stage=name, quantile=quantile)
+                lines.append(f"face_stage_seconds{{{labels}}} {value:.6f}")
+            labels = _labels(process=process, stage=name)
+            lines.append(f"face_stage_seconds_sum{{{labels}}} {stats['sum']:.6f}")
+            lines.append(f"face_stage_seconds_count{{{labels}}} {stats['count']}")
+
+    lines += [
+        "# HELP face_events_total Events such as captured and dropped frames",
+        "# TYPE face_events_total counter",
+    ]
+    for process, snap in snapshots.items():
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f"face_events_total{{{_labels(process=process, event=name)}}} {value}")
+
+    lines += [
+        f"# HELP face_events_per_second Rate of events over the last {RATE_SECONDS:g} seconds (FPS)",
+        "# TYPE face_events_per_second gauge",
+    ]
+    for process, snap in snapshots.items():
+        for name, value in sorted(snap["rates"].items()):
+            lines.append(f"face_events_per_second{{{_labels(process=process, event=name)}}} {value:.3f}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+تشغيل التعرف على الوجوه على عدة كاميرات بدون واجهة
+Headless multi-stream recognition: one worker process per video source
+
+Sources can be device indices, RTSP/HTTP URLs or video files:
+
+    python multi_camera.py 0 1 rtsp://10.0.0.5/stream entrance.mp4 --seconds 60
+
+The gallery is loaded once by the parent and written as a memory-mapped
+snapshot that every worker opens read-only.
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import queue
+import shutil
+import sys
+import tempfile
+import time
+
+UNKNOWN_NAME = "غير معروف"
+
+
+def parse_source(source):
+    """Device index for numeric sources, otherwise a URL or file path"""
+    return int(source) if source.isdigit() else source
+
+
+# -----------------------------------------------------
+# عملية المعالجة لكل كاميرا
+# -----------------------------------------------------
+def stream_worker(stream, source, snapshot_dir, options, results, stop_event):
+    """Detect/recognize loop for one stream, reporting stats to the parent"""
+    import cv2
+    from face_recognizer import FaceRecognizer, FaceTracker
+
+    # One process per stream already uses every core; keep OpenCV from
+    # spawning its own thread pool in each of them
+    cv2.setNumThreads(1)
+
+    recognizer = FaceRecognizer(
+        snapshot=snapshot_dir,
+        detection_scale=options["detection_scale"],
+        ann_probes=options["ann_probes"],
+    )
+    tracker = FaceTracker(recognizer, detect_every=options["detect_every"])
+
+    capture = cv2.VideoCapture(parse_source(source))
+    if not capture.isOpened():
+        results.put({"stream": stream, "error": "فشل في فتح المصدر", "done": True})
+        return
+
+    frames = 0
+    matches = {}
+    started = time.perf_counter()
+    last_report = started
+
+    while not stop_event.is_set():
+        ret, frame = capture.read()
+        if not ret or frame is None:
+            break
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        for track in tracker.update(gray):
+            # Count a sighting each time a track is (re)identified
+            if track.frames_since_id == 0 and track.name != UNKNOWN_NAME:
+                sighting = matches.setdefault(track.name, {"count": 0, "best_confidence": 0.0})
+                sighting["count"] += 1
+                sighting["best_confidence"] = max(sighting["best_confidence"], track.confidence)
+        frames += 1
+
+        now = time.perf_counter()
+        if now - last_report >= options["report_every"]:
+            results.put({"stream": stream, "frames": frames,
+                         "elapsed": now - started, "matches": matches})
+            last_report = now
+
+    capture.release()
+    results.put({"stream": stream, "frames": frames, "elapsed": time.perf_counter() - started,
+                 "matches": matches, "done": True})
+
+
+# -----------------------------------------------------
+# التقرير المجمع
+# -----------------------------------------------------
+def format_report(stats):
+    lines = ["=" * 60]
+    total_fps = 0.0
+    for stream, entry in stats.items():
+        if "error" in entry:
+            lines.append(f"✗ {stream}: {entry['error']}")
+            continue
+        fps = entry["frames"] / entry["elapsed"] if entry["elapsed"] else 0.0
+        total_fps += fps
+        names = ", ".join(f"{name} ({m['count']})" for name, m in entry["matches"].items())
+        lines.append(f"{stream}: {entry['frames']} إطار، {fps:.1f} إطار/ث  {names}")
+    lines.append(f"المجموع: {total_fps:.1f} إطار/ث")
+    lines.append("=" * 60)
+    return "\n".join(lines)
+
+
+def run(sources, options, seconds=None, report_path=None):
+    from face_recognizer import FaceRecognizer
+
+    recognizer = FaceRecognizer(ann_probes=options["ann_probes"])
+    snapshot_dir = tempfile.mkdtemp(prefix="gallery_")
+    recognizer.save_snapshot(snapshot_dir)
+    del recognizer
+
+    results = mp.Queue()
+    stop_event = mp.Event()
+    # The same source may be listed twice, so streams are named by position
+    streams = [f"#{i + 1} {source}" for i, source in enumerate(sources)]
+    workers = [
+        mp.Process(target=stream_worker,
+                   args=(stream, source, snapshot_dir, options, results, stop_event),
+                   daemon=True)
+        for stream, source in zip(streams, sources)
+    ]
+    for worker in workers:
+        worker.start()
+
+    stats = {}
+    done = set()
+    deadline = time.monotonic() + seconds if seconds else None
+
+    try:
+        while len(done) < len(streams):
+            # A worker that crashed never reports "done"
+            if not any(worker.is_alive() for worker in workers) and results.empty():
+                break
+
+            if deadline and time.monotonic() >= deadline:
+                stop_event.set()
+                deadline = None
+
+            try:
+                entry = results.get(timeout=options["report_every"])
+            except queue.Empty:
+                continue
+
+            stats[entry["stream"]] = entry
+            if entry.get("done"):
+                done.add(entry["stream"])
+            print(format_report(stats))
+
+    except KeyboardInterrupt:
+        stop_event.set()
+
+    for worker in workers:
+        worker.join(timeout=5)
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless face recognition on several streams")
+    parser.add_argument("sources", nargs="+",
+                        help="camera index, RTSP/HTTP URL or video file")
+    parser.add_argument("--seconds", type=float, default=None,
+                        help="stop after this many seconds (default: until streams end)")
+    parser.add_argument("--detect-every", type=int, default=5)
+    parser.add_argument("--detection-scale", type=float, default=1.0)
+    parser.add_argument("--ann-probes", type=int, default=None)
+    parser.add_argument("--report-every", type=float, default=5.0,
+                        help="seconds between progress reports")
+    parser.add_argument("--report", default=None, help="write the final report as JSON")
+    args = parser.parse_args()
+
+    options = {
+        "detect_every": args.detect_every,
+        "detection_scale": args.detection_scale,
+        "ann_probes": args.ann_probes,
+        "report_every": args.report_every,
+    }
+    run(args.sources, options, args.seconds, args.report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+قناة الاتصال مع نظام التعرف المقيم
+Local IPC between bridge.py and the resident camera_recognition.py process
+
+camera_recognition.py runs once and keeps running: it owns the camera and
+the gallery. Instead of starting another copy for every report, bridge.py
+sends it small commands over a Unix socket (a named pipe on Windows):
+
+    ping              -> {"ok": True}
+    person_added      -> enroll ``person_ids`` from their stored templates
+    person_removed    -> drop ``person_ids`` from the gallery
+    show              -> bring the window to the front
+    metrics           -> {"metrics": metrics.snapshot()} of the process
+
+Without ``person_ids`` the gallery is compared with the database, which
+also catches changes whose notification was missed. Connections are
+authenticated with a random key kept in data/recognition.key, since
+messages are pickled.
+"""
+
+import os
+import secrets
+import sys
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+SOCKET_PATH = "data/recognition.sock"
+PIPE_NAME = r"\\.\pipe\absher-recognition"
+KEY_PATH = "data/recognition.key"
+
+# Seconds a client waits for a reply before treating the service as gone
+REPLY_TIMEOUT = 5.0
+
+
+def service_address():
+    """``(address, family)`` of the service for this platform"""
+    if sys.platform == 'win32':
+        return PIPE_NAME, 'AF_PIPE'
+    return os.path.abspath(SOCKET_PATH), 'AF_UNIX'
+
+
+def _authkey():
+    """Shared secret of the service, created on first use"""
+    try:
+        with open(KEY_PATH, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(KEY_PATH), exist_ok=True)
+    try:
+        fd = os.open(KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Created by the other side in the meantime
+        with open(KEY_PATH, 'rb') as f:
+            return f.read()
+
+    key = secrets.token_bytes(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def send_command(cmd, timeout=REPLY_TIMEOUT, **fields):
+    """Send a command to the running service
+
+    Returns the reply dict, or None when no service is running or it did
+    not answer within ``timeout`` seconds.
+    """
+    address, family = service_address()
+    try:
+        conn = Client(address, family, authkey=_authkey())
+    except (OSError, EOFError, AuthenticationError):
+        return None
+
+    with conn:
+        try:
+            conn.send(dict(fields, cmd=cmd))
+            if not conn.poll(timeout):
+                return None
+            return conn.recv()
+        except (OSError, EOFError):
+            return None
+
+
+class RecognitionService:
+    """Serve commands to a handler on a background thread
+
+    ``handlers`` maps a command name to ``handler(message) -> reply dict``.
+    Handlers run on the service thread, one connection at a time.
+    """
+
+    def __init__(self, handlers):
+        self.handlers = dict(handlers)
+        self.handlers.setdefault('ping', lambda message: {'ok': True})
+
+        self._listener = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start listening; returns False if another instance is serving"""
+        address, family = service_address()
+        if family == 'AF_UNIX' and os.path.exists(address):
+            if send_command('ping') is not None:
+                return False
+            # Left behind by a process that did not shut down cleanly
+            os.remove(address)
+
+        try:
+            self._listener = Listener(address, family, authkey=_authkey())
+        except OSError:
+            # The pipe name is taken by a running instance
+            return False
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name="recognition-service", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if self._listener is None:
+            return
+        self._stop.set()
+
+        # accept() is not interrupted by close() everywhere; a last
+        # connection wakes the thread up
+        send_command('ping', timeout=0.5)
+        self._listener.close()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        self._listener = None
+        self._thread = None
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                continue
+
+            with conn:
+                try:
+                    message = conn.recv()
+                    conn.send(self._dispatch(message))
+                except (OSError, EOFError):
+                    pass
+
+    def _dispatch(self, message):
+        handler = self.handlers.get(message.get('cmd'))
+        if handler is None:
+            return {'ok': False, 'error': f"unknown command: {message.get('cmd')}"}
+        try:
+            reply = handler(message)
+        except Exception as e:
+            print(f"خطأ في خدمة التعرف: {str(e)}")
+            return {'ok': False, 'error': str(e)}
+        return dict(reply or {}, ok=True)
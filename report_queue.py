@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+طابور معالجة البلاغات في الخلفية
+Durable report ingestion queue processed by a pool of background threads
+
+Submitted reports are stored in the ``report_jobs`` table first, so the
+HTTP request only has to save the photo and insert one row. Worker
+threads claim queued jobs, run the enrollment handler and record the
+outcome, which ``status`` reports back to the client. Jobs interrupted by
+a crash are picked up again once their lease has expired.
+"""
+
+import threading
+import time
+import uuid
+
+# Enrollment threads; detection runs outside the recognizer lock so a
+# couple of workers overlap decoding/detection of bursty submissions
+REPORT_WORKERS = 2
+
+# Seconds an idle worker waits before checking the table again (jobs
+# queued by this process wake the workers immediately)
+POLL_INTERVAL = 1.0
+
+# Runs of a job interrupted by a crash before it is given up on
+MAX_ATTEMPTS = 3
+
+# Seconds after being claimed that a job still in 'processing' is
+# considered abandoned. Enrollment takes seconds; anything younger may
+# belong to a live worker of another bridge process.
+JOB_LEASE = 600
+
+# How often idle workers look for abandoned jobs
+RECOVER_INTERVAL = 60.0
+
+
+class ReportQueue:
+    """Queue reports in the database and enroll them in the background
+
+    ``handler(name, photo_path)`` does the actual work and returns
+    ``(success, message)``.
+    """
+
+    def __init__(self, db, handler, workers=REPORT_WORKERS, poll_interval=POLL_INTERVAL,
+                 lease=JOB_LEASE):
+        self.db = db
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._recover_lock = threading.Lock()
+        self._recovered_at = 0.0
+
+    def start(self):
+        """Recover abandoned jobs and start the worker threads"""
+        self._recover()
+
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"report-worker-{i + 1}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, name, photo_path):
+        """Queue a report; returns its job id"""
+        job_id = uuid.uuid4().hex
+        self.db.add_report_job(job_id, name, photo_path)
+        with self._condition:
+            self._condition.notify()
+        return job_id
+
+    def status(self, job_id):
+        """Current state of a job as a dict, or None for an unknown id"""
+        job = self.db.get_report_job(job_id)
+        if job is None:
+            return None
+
+        job_id, name, status, message, attempts, created_at, updated_at = job
+        return {
+            'id': job_id,
+            'name': name,
+            'status': status,
+            'message': message,
+            'attempts': attempts,
+            'created_at': created_at,
+            'updated_at': updated_at,
+        }
+
+    def _recover(self):
+        """Requeue jobs whose lease expired (their process is gone)"""
+        with self._recover_lock:
+            self._recovered_at = time.monotonic()
+            requeued = self.db.requeue_report_jobs(MAX_ATTEMPTS, self.lease,
+                                                   "توقفت المعالجة بشكل غير متوقع")
+        if requeued:
+            print(f"✓ تمت إعادة {requeued} بلاغ إلى الطابور")
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                job = self.db.claim_report_job()
+                if job is None and time.monotonic() - self._recovered_at >= RECOVER_INTERVAL:
+                    self._recover()
+            except Exception as e:
+                print(f"خطأ في طابور البلاغات: {str(e)}")
+                job = None
+
+            if job is None:
+                with self._condition:
+                    self._condition.wait(self.poll_interval)
+                continue
+
+            self._process(*job)
+
+    def _process(self, job_id, name, photo_path, attempt):
+        print(f"⏳ معالجة البلاغ {job_id[:8]} ({name})، المحاولة {attempt}")
+        try:
+            success, message = self.handler(name, photo_path)
+        except Exception as e:
+            success, message = False, f"خطأ: {str(e)}"
+
+        self.db.finish_report_job(job_id, 'done' if success else 'failed', message)
+        if success:
+            print(f"✓ تم إضافة الشخص: {name}")
+        else:
+            print(f"✗ فشل البلاغ {job_id[:8]}: {message}")
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+البحث عن الأشخاص المفقودين في تسجيلات الفيديو
+Offline footage scanner: search recorded video against the current gallery
+
+    python scan_footage.py recordings/ gate1.mp4 --stride 15 --output sightings.json
+    python scan_footage.py photos_dump/ --format csv --output sightings.csv
+
+Inputs can be video files, image files or directories (scanned
+recursively). Every ``stride``-th frame is decoded and searched. Frames
+are decoded on the main thread while a pool of worker threads runs
+detection and recognition; the number of frames in flight is bounded so
+memory stays flat regardless of the footage length. Consecutive hits of
+the same person in the same source are merged into one sighting.
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+VIDEO_EXTENSIONS = {".mp4", ".avi", ".mkv", ".mov", ".m4v", ".wmv", ".webm", ".ts"}
+
+# Frames decoded ahead of recognition, per worker
+FRAMES_IN_FLIGHT = 4
+
+
+def collect_inputs(paths):
+    """Expand directories into the video and image files they contain"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS | VIDEO_EXTENSIONS:
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    return files
+
+
+# -----------------------------------------------------
+# قراءة الإطارات
+# -----------------------------------------------------
+def iter_frames(files, stride):
+    """Yield ``(source, timestamp, gray_frame)`` for every stride-th frame
+
+    Skipped video frames are only grabbed, never retrieved or converted.
+    Images are grouped by directory; their timestamp is their position in
+    the directory listing.
+    """
+    image_index = {}
+    for path in files:
+        ext = os.path.splitext(path)[1].lower()
+
+        if ext in IMAGE_EXTENSIONS:
+            source = os.path.dirname(path) or "."
+            index = image_index.get(source, 0)
+            image_index[source] = index + 1
+            if index % stride:
+                continue
+
+            with open(path, 'rb') as f:
+                data = np.frombuffer(f.read(), dtype=np.uint8)
+            gray = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+            if gray is None:
+                print(f"✗ فشل فتح الصورة: {path}", file=sys.stderr)
+                continue
+            yield source, float(index), gray
+            continue
+
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            print(f"✗ فشل فتح الملف: {path}", file=sys.stderr)
+            continue
+
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        index = 0
+        while True:
+            if index % stride:
+                if not capture.grab():
+                    break
+                index += 1
+                continue
+
+            ret, frame = capture.read()
+            if not ret or frame is None:
+                break
+            yield path, index / fps, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            index += 1
+
+        capture.release()
+
+
+# -----------------------------------------------------
+# تجميع المشاهدات
+# -----------------------------------------------------
+class SightingTimeline:
+    """Merge per-frame hits into sightings (one per person and time span)"""
+
+    def __init__(self, merge_gap):
+        self.merge_gap = merge_gap
+        self.open = {}
+        self.closed = []
+
+    def add(self, source, timestamp, person_id, name, confidence):
+        key = (source, person_id)
+        sighting = self.open.get(key)
+
+        if sighting is not None and timestamp - sighting["end"] > self.merge_gap:
+            self.closed.append(sighting)
+            sighting = None
+
+        if sighting is None:
+            sighting = {
+                "person_id": person_id,
+                "name": name,
+                "source": source,
+                "start": timestamp,
+                "end": timestamp,
+                "hits": 0,
+                "best_confidence": 0.0,
+            }
+            self.open[key] = sighting
+
+        sighting["end"] = timestamp
+        sighting["hits"] += 1
+        sighting["best_confidence"] = max(sighting["best_confidence"], round(confidence, 1))
+
+    def sightings(self):
+        result = self.closed + list(self.open.values())
+        return sorted(result, key=lambda s: (s["person_id"], s["source"], s["start"]))
+
+
+def recognize(recognizer, gray):
+    faces = recognizer.detect_faces_in_frame(gray)
+    return recognizer.match_boxes(gray, faces, verbose=False)
+
+
+def scan(recognizer, files, stride=1, workers=None, merge_gap=5.0):
+    """Scan the inputs and return ``(sightings, frames_scanned)``"""
+    workers = workers or os.cpu_count() or 1
+    timeline = SightingTimeline(merge_gap)
+    pending = deque()
+    frames = 0
+
+    def consume(item):
+        source, timestamp, future = item
+        for person_id, name, confidence in future.result():
+            if person_id is not None:
+                timeline.add(source, timestamp, person_id, name, confidence)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for source, timestamp, gray in iter_frames(files, stride):
+            pending.append((source, timestamp, pool.submit(recognize, recognizer, gray)))
+            frames += 1
+
+            # Results are consumed in frame order, which the merging relies
+            # on, and this also caps the number of decoded frames in memory
+            while len(pending) > workers * FRAMES_IN_FLIGHT:
+                consume(pending.popleft())
+
+        while pending:
+            consume(pending.popleft())
+
+    return timeline.sightings(), frames
+
+
+def write_report(sightings, path, fmt, summary):
+    if fmt == "csv":
+        out = open(path, 'w', newline='', encoding='utf-8') if path else sys.stdout
+        writer = csv.DictWriter(out, fieldnames=["person_id", "name", "source", "start", "end",
+                                                 "hits", "best_confidence"])
+        writer.writeheader()
+        for sighting in sightings:
+            writer.writerow({**sighting, "start": round(sighting["start"], 2),
+                             "end": round(sighting["end"], 2)})
+        if path:
+            out.close()
+        return
+
+    report = dict(summary, sightings=sightings)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+def main():
+    from face_recognizer import FaceRecognizer
+
+    parser = argparse.ArgumentParser(description="Search recorded footage for missing people")
+    parser.add_argument("inputs", nargs="+", help="video files, images or directories")
+    parser.add_argument("--stride", type=int, default=10, help="process every N-th frame")
+    parser.add_argument("--workers", type=int, default=None, help="recognition threads")
+    parser.add_argument("--merge-gap", type=float, default=5.0,
+                        help="seconds (or images) between hits merged into one sighting")
+    parser.add_argument("--detection-scale", type=float, default=1.0)
+    parser.add_argument("--ann-probes", type=int, default=None)
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--output", default=None, help="report file (default: stdout)")
+    args = parser.parse_args()
+
+    files = collect_inputs(args.inputs)
+    if not files:
+        print("✗ لا توجد ملفات للبحث", file=sys.stderr)
+        return 1
+
+    # stdout carries the report only; the recognizer's load messages and
+    # anything printed while scanning go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        recognizer = FaceRecognizer(detection_scale=args.detection_scale,
+                                    ann_probes=args.ann_probes)
+
+        started = time.perf_counter()
+        sightings, frames = scan(recognizer, files, max(1, args.stride), args.workers,
+                                 args.merge_gap)
+        elapsed = time.perf_counter() - started
+
+    print(f"✓ تم فحص {frames} إطار من {len(files)} ملف في {elapsed:.1f} ثانية "
+          f"({frames / elapsed if elapsed else 0:.1f} إطار/ث) - {len(sightings)} مشاهدة",
+          file=sys.stderr)
+
+    summary = {
+        "inputs": files,
+        "stride": args.stride,
+        "frames_scanned": frames,
+        "elapsed_seconds": round(elapsed, 2),
+    }
+    write_report(sightings, args.output, args.format, summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())